@@ -25,6 +25,7 @@ PARAMS["license"] = information.LICENSE
 
 PARAMS["scripts"] = [
         "bin/singularity",
+        "scripts/replay",
         ]
 PARAMS["packages"] = [
         "singularity",
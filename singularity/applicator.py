@@ -13,19 +13,44 @@ from singularity.configurators.features import FeaturesConfigurator
 logger = logging.getLogger("console") # pylint: disable=C0103
 
 class SingularityApplicator(object):
-    def __call__(self, actions = None):
+    def __init__(self, root = os.path.sep):
+        """Apply configurations to the filesystem rooted at root.
+
+        ### Arguments
+
+        Argument | Description
+        -------- | -----------
+        root     | The directory the cached filenames are relative to.
+
+        ### Description
+
+        Everything but scripts/replay (which must not touch the system it
+        runs on) uses the default of /.
+
+        """
+
+        self.root = root
+
+    def __call__(self, actions = None, keys = None):
         """Apply an existing configuration to the system.
 
+        ### Arguments
+
+        Argument | Description
+        -------- | -----------
+        actions  | The functions to apply (defaults to the CLI's action).
+        keys     | The cache keys to apply (defaults to every key in the cache).
+
         ### Description
 
         Checks for an existing set of configuration items in the cache
         directory (defaults to /var/cache/singularity) and replaces the
         corresponding items in the filesystem.
 
-        We iterate over all files in the cache regardless because there should
-        be a very small number of files generated.  If this is ever not the
-        case; we will need to revisit this design and update it to be more
-        efficient.
+        The daemon passes the keys it just wrote to the cache so only those
+        files are touched.  Without keys (i.e. singularity apply) every key in
+        the cache is considered.  In both cases a cached file is only read
+        once its function has passed the actions filter.
 
         """
 
@@ -47,19 +72,28 @@ class SingularityApplicator(object):
 
         logger.info("Actions to be applied: %s", actions)
 
-        for key, content in SingularityCache().iteritems():
+        cache = SingularityCache()
+
+        if keys is None:
+            keys = cache.iterkeys()
+
+        for key in keys:
             function, filename = key.split('.', 1)
 
             if function not in actions:
                 logger.info("Skipping %s since %s is not an allowed function.", filename, function) # pylint: disable=C0301
                 continue
 
+            filename = os.path.join(self.root, filename.lstrip(os.path.sep))
+
             if not os.path.exists(os.path.dirname(filename)):
                 os.makedirs(os.path.dirname(filename))
 
             if SingularityParameters()["main.backup"]:
                 os.rename(filename, filename + ".bak")
 
+            content = cache[key]
+
             with open(filename, "w") as output:
                 output.write("\n".join(content) + "\n")
 
@@ -8,6 +8,7 @@ import itertools
 import os
 import glob
 
+from singularity import metrics
 from singularity.parameters import SingularityParameters
 
 logger = logging.getLogger("console") # pylint: disable=C0103
@@ -36,8 +37,57 @@ class SingularityCache(object): # pylint: disable=R0903
         return list(self.iterfiles())
 
     def iterfiles(self): # pylint: disable=R0201
-        """Generator of list of files in the cache."""
-        return itertools.chain(*[ [ os.path.join(file_[0], name) for name in file_[2] ] for file_ in os.walk(SingularityParameters()["main.cache"]) if len(file_[2]) ]) # pylint: disable=C0301
+        """Generator of list of files in the cache.
+
+        ### Description
+
+        Directories whose names start with a '.' (i.e. .fingerprints) hold
+        singularity's own bookkeeping and are skipped.
+
+        """
+
+        return itertools.chain(*[ [ os.path.join(file_[0], name) for name in file_[2] ] for file_ in _walk(SingularityParameters()["main.cache"]) if len(file_[2]) ]) # pylint: disable=C0301
+
+    def get_fingerprint(self, name): # pylint: disable=R0201
+        """The fingerprint last applied for name (None if there is none)."""
+
+        try:
+            with open(fingerprint_path(name), "r") as fingerprint:
+                return fingerprint.read().strip()
+        except IOError:
+            return None
+
+    def set_fingerprint(self, name, digest): # pylint: disable=R0201
+        """Record digest as the fingerprint last applied for name."""
+
+        path = fingerprint_path(name)
+
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        with open(path + ".new", "w") as fingerprint:
+            fingerprint.write(digest + "\n")
+
+        os.rename(path + ".new", path)
+
+    @property
+    def statistics(self): # pylint: disable=R0201
+        """Size of the cache and the reads and writes since the daemon started."""
+
+        files = list(self.iterfiles())
+
+        fingerprints = os.path.dirname(fingerprint_path("name"))
+
+        return {
+                "path": SingularityParameters()["main.cache"],
+                "files": len(files),
+                "bytes": sum([ os.path.getsize(path) for path in files if os.path.isfile(path) ]), # pylint: disable=C0301
+                "fingerprints": sorted(os.listdir(fingerprints)) if os.path.isdir(fingerprints) else [], # pylint: disable=C0301
+                "reads": sum(metrics.counters("singularity_cache_reads_total").values()), # pylint: disable=C0301
+                "read_bytes": sum(metrics.counters("singularity_cache_read_bytes_total").values()), # pylint: disable=C0301
+                "writes": sum(metrics.counters("singularity_cache_writes_total").values()), # pylint: disable=C0301
+                "written_bytes": sum(metrics.counters("singularity_cache_written_bytes_total").values()), # pylint: disable=C0301
+                }
 
     def __len__(self):
         """Number of files in the cache."""
@@ -64,7 +114,12 @@ class SingularityCache(object): # pylint: disable=R0903
         logger.info("Retrieving item with function, %s, and filename, %s", function, filename) # pylint: disable=C0301
 
         with open(cache_path(function, filename), "r") as cachefile:
-            return [ line.strip() for line in cachefile.readlines() ]
+            lines = cachefile.readlines()
+
+        metrics.increment("singularity_cache_reads_total")
+        metrics.increment("singularity_cache_read_bytes_total", sum([ len(line) for line in lines ])) # pylint: disable=C0301
+
+        return [ line.strip() for line in lines ]
 
     def __setitem__(self, key, value):
         """Set the contents of a specified file in the cache.
@@ -85,8 +140,13 @@ class SingularityCache(object): # pylint: disable=R0903
 
         # TODO Check for conflicts.
 
+        content = "\n".join(value) + "\n"
+
         with open(cache_path(function, filename), "w") as cachefile:
-            cachefile.write("\n".join(value) + "\n")
+            cachefile.write(content)
+
+        metrics.increment("singularity_cache_writes_total")
+        metrics.increment("singularity_cache_written_bytes_total", len(content)) # pylint: disable=C0301
 
     def __delitem__(self, key):
         """Delete a file from the cache."""
@@ -160,3 +220,33 @@ def cache_path(function, filename):
 
     return os.path.join(SingularityParameters()["main.cache"], function, filename[1:]) # pylint: disable=C0301
 
+def fingerprint_path(name):
+    """Return the path of the fingerprint last applied for name.
+
+    ### Description
+
+    Fingerprints are kept per configurator (see fingerprint_name) since
+    configurators sharing a function look at different parts of a message.
+
+    ### Examples
+
+    Assuming a default cache location:
+
+    >>> fingerprint_path("singularity.configurators.network.NetworkConfigurator")
+    '/var/cache/singularity/.fingerprints/singularity.configurators.network.NetworkConfigurator'
+
+    """
+
+    return os.path.join(SingularityParameters()["main.cache"], ".fingerprints", name) # pylint: disable=C0301
+
+def fingerprint_name(configurator):
+    """The name configurator's fingerprints are kept under (module.class)."""
+
+    return "{0}.{1}".format(configurator.__class__.__module__, configurator.__class__.__name__) # pylint: disable=C0301
+
+def _walk(top):
+    """os.walk that doesn't descend into directories starting with '.'."""
+
+    for directory, directories, files in os.walk(top):
+        directories[:] = [ name for name in directories if not name.startswith(".") ] # pylint: disable=C0301
+        yield directory, directories, files
@@ -6,6 +6,7 @@
 import logging
 
 from singularity import helpers
+from singularity.parameters import SingularityParameters
 
 logger = logging.getLogger("console") # pylint: disable=C0103
 
@@ -22,6 +23,9 @@ def create(*args, **kwargs):
     since this is not dynamically pluggable it acts as a check that nothing
     blatant is missing upon release.
 
+    If daemon.record is set every message received is also appended to that
+    file (see singularity.communicators.recorder).
+
     """
 
     communicator = None
@@ -39,9 +43,24 @@ def create(*args, **kwargs):
     if not isinstance(communicator, Communicator):
         communicator = None
 
+    if communicator is not None and SingularityParameters()["daemon.record"]:
+        from singularity.communicators.recorder import Recorder
+        communicator.recorder = Recorder(SingularityParameters()["daemon.record"]) # pylint: disable=C0301
+
     return communicator
 
 class Communicator(object):
+    recorder = None
+
+    # Identifiers that still name the same request after a restart (and so
+    # can be answered from the journal).
+    durable = False
+
+    @property
+    def depth(self): # pylint: disable=R0201
+        """Number of messages received but not yet returned by receive."""
+        return 0
+
     def receive(self):
         """Receive a message from the hypervisor and pass it to the requester.
 
@@ -62,6 +81,70 @@ class Communicator(object):
 
         raise NotImplementedError("class {0} does not implement 'receive(self)'".format(self.__class__.__name__)) # pylint: disable=C0301
 
+    def record(self, identifier, payload, **kwargs):
+        """Pass a received message to the recorder (if there is one).
+
+        ### Arguments
+
+        Argument   | Description
+        --------   | -----------
+        identifier | The identifier the message was received with.
+        payload    | The message as it was received (before translation).
+        kwargs     | Anything else needed to reproduce the message.
+
+        ### Description
+
+        Communicators call this from receive with the raw payload so that
+        scripts/replay can push the same traffic through translate and the
+        rest of the daemon.
+
+        """
+
+        if self.recorder is not None:
+            self.recorder(identifier, payload, **kwargs)
+
+    def accepted(self, identifier):
+        """The daemon has taken responsibility for the message identifier.
+
+        ### Description
+
+        Called once a message returned by receive has been journaled (see
+        singularity.journal).  Communicators that can leave a message with
+        the hypervisor until then (i.e. XenCommunicator) remove it here so a
+        daemon dying in between finds it again.
+
+        """
+
+        pass
+
+    def pause(self):
+        """Stop taking new messages from the hypervisor.
+
+        ### Description
+
+        Messages already taken (i.e. queued) are still returned by receive.
+        Used when the daemon drains; does nothing unless the communicator can
+        leave new requests for the next daemon.
+
+        """
+
+        pass
+
+    def handoff(self): # pylint: disable=R0201
+        """Stop taking messages and describe what a replacement needs.
+
+        ### Description
+
+        Called in the old daemon when a new one takes over (see
+        singularity.handoff).  Returns a JSON serializable state and a list of
+        file descriptors that are passed to the new daemon's communicator as
+        its inherited argument.  Messages already returned by receive are
+        still answered through this communicator.
+
+        """
+
+        return {}, []
+
     def send(self, identifier, message, status = 0):
         """Send a message (or response) to the hypervisor.
 
@@ -0,0 +1,164 @@
+# Copyright (C) 2012 by Alex Brandt <alunduil@alunduil.com>
+#
+# singularity is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Bounded queue of received messages with an overflow policy.
+
+### Description
+
+Communicators queue what the hypervisor sends until the daemon receives it.
+A host writing requests faster than they are handled (or maliciously) would
+grow an unbounded queue without limit so BoundedQueue holds at most maxsize
+items.  When it is full put applies the overflow policy:
+
+dropoldest removes the oldest queued item the victim function (given to put)
+accepts, i.e. a resetnetwork a later resetnetwork supersedes, and queues the
+new item.  If no queued item qualifies the new item is refused.
+
+busy refuses the new item.
+
+put returns the item that was refused or removed (or None) so the
+communicator can tell the host to try again later (see BUSY_STATUS).
+
+"""
+
+import collections
+import json
+import threading
+import time
+import Queue
+
+import singularity.communicators.helpers as helpers
+
+from singularity.parameters import SingularityParameters
+
+BUSY_STATUS = 75 # EX_TEMPFAIL; the host should retry the request.
+
+POLICIES = [ "dropoldest", "busy", ]
+
+class BoundedQueue(object):
+    def __init__(self, maxsize = 0, policy = "dropoldest"):
+        """A queue of at most maxsize (0 for no limit) items.
+
+        ### Description
+
+        Supports the parts of Queue.Queue the communicators use: put, get
+        (with a timeout), get_nowait and qsize.
+
+        """
+
+        if policy not in POLICIES:
+            raise ValueError("unknown overflow policy, {0}; known policies: {1}".format(policy, ", ".join(POLICIES))) # pylint: disable=C0301
+
+        self.maxsize = maxsize
+        self.policy = policy
+
+        self.enqueued = 0
+        self.dropped = 0
+        self.high_water = 0
+
+        self._items = collections.deque()
+        self._condition = threading.Condition()
+
+    def qsize(self):
+        """Number of queued items."""
+        with self._condition:
+            return len(self._items)
+
+    def put(self, item, victim = None, force = False):
+        """Queue item; returns the item refused or removed or None.
+
+        ### Arguments
+
+        Argument | Description
+        -------- | -----------
+        item     | The item to queue.
+        victim   | Called with a queued item; True if dropoldest may drop it.
+        force    | Queue item even if the queue is full (i.e. requeueing).
+
+        """
+
+        with self._condition:
+            refused = None
+
+            if not force and self.maxsize and len(self._items) >= self.maxsize:
+                if self.policy == "dropoldest" and victim is not None:
+                    for queued in self._items:
+                        if victim(queued):
+                            refused = queued
+                            self._items.remove(queued)
+                            break
+
+                if refused is None:
+                    self.dropped += 1
+                    return item
+
+                self.dropped += 1
+
+            self._items.append(item)
+
+            self.enqueued += 1
+            self.high_water = max(self.high_water, len(self._items))
+
+            self._condition.notify()
+
+            return refused
+
+    def get(self, block = True, timeout = None):
+        """Remove and return the oldest item (Queue.Empty if none arrives)."""
+
+        with self._condition:
+            if not block:
+                if not len(self._items):
+                    raise Queue.Empty()
+            elif timeout is None:
+                while not len(self._items):
+                    self._condition.wait()
+            else:
+                expires = time.time() + timeout
+
+                while not len(self._items):
+                    remaining = expires - time.time()
+
+                    if remaining <= 0:
+                        raise Queue.Empty()
+
+                    self._condition.wait(min(remaining, 1.0)) # Short waits keep signals deliverable. # pylint: disable=C0301
+
+            return self._items.popleft()
+
+    def get_nowait(self):
+        """Remove and return the oldest item or raise Queue.Empty."""
+        return self.get(block = False)
+
+def create():
+    """A BoundedQueue sized and with the policy from the parameters."""
+
+    return BoundedQueue(int(SingularityParameters()["daemon.queuesize"] or 0), SingularityParameters()["daemon.overflow"] or "dropoldest") # pylint: disable=C0301
+
+def supersedable():
+    """Victim for put: queued (key, raw message) items a later one replaces.
+
+    ### Description
+
+    Those are the messages for a function listed in daemon.idempotent.
+
+    """
+
+    idempotent = set([ name.strip() for name in (SingularityParameters()["daemon.idempotent"] or "").split(",") if len(name.strip()) ]) # pylint: disable=C0301
+
+    return lambda item: function(item[1]) in idempotent
+
+def function(message):
+    """The function a raw queued message asks for (None if unknown)."""
+
+    if isinstance(message, dict):
+        return message.get("function")
+
+    try:
+        name = json.loads(message).get("name")
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+    return helpers.FUNCTION_NAMES.get(name, name)
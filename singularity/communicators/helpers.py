@@ -4,11 +4,27 @@
 # See COPYING or http://www.opensource.org/licenses/mit-license.php.
 
 import logging
+import errno
+import fcntl
 import json
 import os
+import socket
+import struct
+import threading
+
+from singularity import tracing
 
 logger = logging.getLogger(__name__) # pylint: disable=C0103
 
+# First file descriptor passed by the init system (sd_listen_fds(3)).
+LISTEN_FDS_START = 3
+
+FUNCTION_NAMES = {
+        "injectfile": "file",
+        "agentupdate": "update",
+        }
+
+@tracing.traced("translate")
 def translate(message): # pylint: disable=R0912,R0915
     """Translate the expected message to the new format.
 
@@ -158,130 +174,171 @@ def translate(message): # pylint: disable=R0912,R0915
 
     message = {}
 
-    # TOOD Refactor this "parsing" to be more elegant.
-
-    try:
+    if "name" in parsed:
         message["function"] = parsed["name"]
-    except KeyError:
-        logger.warning("Did not recieve 'name' from message")
-    
-    try:
+
+    if "value" in parsed:
         message["arguments"] = parsed["value"]
-    except KeyError:
-        logger.warning("Did not recieve 'value' from message")
 
-    message["ips"] = {}
+    if parsed.get("force"):
+        message["force"] = True
 
-    logger.debug("Parsed Keys: %s", parsed.keys())
+    nic = None
 
-    try:
-        logger.debug("Interface name for %s: %s", parsed["mac"], interface(parsed["mac"])) # pylint: disable=C0301
-        message["ips"][interface(parsed["mac"])] = []
-    except KeyError as error:
-        logger.exception(error)
-        logger.warning("Did not receive 'mac' from message")
+    if "mac" in parsed:
+        try:
+            nic = interface(parsed["mac"])
+        except KeyError:
+            logger.warning("Interface for MAC, %s, not found", parsed["mac"])
 
-    try:
-        for ip in parsed["ips"]: # pylint: disable=C0103
-            if ip["enabled"] == "1": # A string?  Really?
-                message["ips"][interface(parsed["mac"])].append((cidr(ip["ip"], ip["netmask"]), "ipv4")) # pylint: disable=C0301
-    except KeyError:
-        logger.warning("Did not receive 'ips' or 'ips.ip' or 'ips.netmask' from message") # pylint: disable=C0301
+    logger.debug("Interface name for %s: %s", parsed.get("mac"), nic)
 
-    try:
-        for ip in parsed["ip6s"]: # pylint: disable=C0103
-            if ip["enabled"] == 1: # A string?  Really?
-                message["ips"][interface(parsed["mac"])].append((cidr(ip["ip"], ip["netmask"]), "ipv6")) # pylint: disable=C0301
-    except KeyError:
-        logger.warning("Did not receive 'ip6s' or ip6s.ip' or 'ip6s.netmask' from message") # pylint: disable=C0301
+    ips = []
+    routes = []
 
-    message["routes"] = {}
+    for key, rules in _SCHEMA:
+        if key not in parsed:
+            logger.debug("Did not receive '%s' from message", key)
+            continue
 
-    try:
-        message["routes"][interface(parsed["mac"])] = []
-    except KeyError:
-        logger.warning("Did not receive 'mac' from message")
+        if rules is None: # A single value rather than a list.
+            if parsed[key] is not None and nic is not None:
+                routes.append(("default", parsed[key], _SCALAR_VERSIONS[key]))
+            continue
 
-    try:
-        for ip in parsed["ips"]: # pylint: disable=C0103
-            if ip["enabled"] == "1" and ip["gateway"] is not None:
-                message["routes"][interface(parsed["mac"])].append(("default", ip["gateway"], "ipv4")) # pylint: disable=C0301
-    except KeyError:
-        logger.warning("Did not receive 'ips' or 'ips.gateway' from message") # pylint: disable=C0301
+        # Each rule stops at the first item missing something it needs (as
+        # if each rule walked the items on its own).
+        active = [ rule for rule in rules ]
 
-    try:
-        for ip in parsed["ip6s"]: # pylint: disable=C0103
-            if ip["enabled"] == "1" and ip["gateway"] is not None:
-                message["routes"][interface(parsed["mac"])].append(("default", ip["gateway"], "ipv6")) # pylint: disable=C0301
-    except KeyError:
-        logger.warning("Did not receive 'ip6s' or 'ip6s.gateway' from message") # pylint: disable=C0301
+        for item in parsed[key]:
+            if not len(active):
+                break
 
-    try:
-        if parsed["gateway"] is not None:
-            message["routes"][interface(parsed["mac"])].append(("default", parsed["gateway"], "ipv4")) # Should be ipv4 but need to verify ... # pylint: disable=C0301 
-    except KeyError:
-        logger.warning("Did not receive 'gateway' from message")
+            for rule in list(active):
+                target, condition, build = rule
 
-    try:
-        if parsed["gateway_v6"] is not None:
-            message["routes"][interface(parsed["mac"])].append(("default", parsed["gateway_v6"], "ipv6")) # Should be ipv4 but need to verify ... # pylint: disable=C0301 
-    except KeyError:
-        logger.warning("Did not receive 'gateway_v6' from message")
+                try:
+                    if condition is not None and not condition(item):
+                        continue
 
-    try:
-        for route in parsed["routes"]:
-            message["routes"][interface(parsed["mac"])].append((cidr(route["route"], route["netmask"]), route["gateway"], "ipv4")) # Should be ipv4 but need to verify ... # pylint: disable=C0301
-    except KeyError:
-        logger.warning("Did not receive 'routes' or 'routes.route' or 'routes.netmask' or 'routes.gateway' from message") # pylint: disable=C0301
+                    if nic is None:
+                        raise KeyError("mac")
 
-    try:
+                    (ips if target == "ips" else routes).append(build(item))
+                except KeyError as error:
+                    logger.debug("Did not receive '%s.%s' from message", key, error.args[0]) # pylint: disable=C0301
+                    active.remove(rule)
+
+    if "dns" in parsed:
         logger.debug("Received DNS list: %s", parsed["dns"])
-        message["resolvers"] = []
-        for resolver in parsed["dns"]:
-            logger.debug("Resolver to create an entry for: %s", resolver)
-            message["resolvers"].append((resolver, "ipv4", interface(parsed["mac"]))) # Should be ipv4 but need to verify ... # pylint: disable=C0301
-    except KeyError:
-        logger.warning("Did not receive 'dns' or 'mac' from message") # pylint: disable=C0301
-        if "resolvers" in message and not len(message["resolvers"]):
-            del message["resolvers"]
 
-    logger.debug("Compiled message: %s", message)
+        message["resolvers"] = [ ( resolver, "ipv4", nic, ) for resolver in parsed["dns"] ] # Should be ipv4 but need to verify ... # pylint: disable=C0301
 
-    if len(message["ips"]):
-        if not any([ len(message["ips"][nic]) for nic in message["ips"].iterkeys() ]): # pylint: disable=C0301
-            del message["ips"]
-    else:
-        del message["ips"]
+        if nic is None and len(message["resolvers"]):
+            del message["resolvers"]
+
+    if len(ips):
+        message["ips"] = { nic: ips, }
 
-    if len(message["routes"]):
-        if not any([ len(message["routes"][nic]) for nic in message["routes"].iterkeys() ]): # pylint: disable=C0301
-            del message["routes"]
-        else:
-            for nic in message["routes"].iterkeys():
-                message["routes"][nic] = list(set(message["routes"][nic])) # Make sure we don't have any duplicate routes on a NIC # pylint: disable=C0301
-    else:
-        del message["routes"]
+    if len(routes):
+        unique = set()
+        message["routes"] = { nic: [ route for route in routes if not (route in unique or unique.add(route)) ], } # Make sure we don't have any duplicate routes on a NIC # pylint: disable=C0301
 
     logger.info("Compiled message: %s", message)
 
     return message
 
+# How translate builds ips and routes from each list in a networking entry:
+# (key, [ (target, condition, build), ... ]) in the order the results are
+# listed.  The rules for a key share one walk over its items.  Single values
+# (the gateways) have no rules and become default routes.
+#
+# The ip6s "enabled" comparisons are not a typo: addresses need the integer
+# 1 but gateways the string "1" (as the hosts have always been answered).
+_SCHEMA = (
+        ( "ips", (
+            ( "ips", lambda ip: ip["enabled"] == "1", lambda ip: ( cidr(ip["ip"], ip["netmask"]), "ipv4", ), ), # pylint: disable=C0301
+            ( "routes", lambda ip: ip["enabled"] == "1" and ip["gateway"] is not None, lambda ip: ( "default", ip["gateway"], "ipv4", ), ), # pylint: disable=C0301
+            ), ),
+        ( "ip6s", (
+            ( "ips", lambda ip: ip["enabled"] == 1, lambda ip: ( cidr(ip["ip"], ip["netmask"]), "ipv6", ), ), # pylint: disable=C0301
+            ( "routes", lambda ip: ip["enabled"] == "1" and ip["gateway"] is not None, lambda ip: ( "default", ip["gateway"], "ipv6", ), ), # pylint: disable=C0301
+            ), ),
+        ( "gateway", None, ),
+        ( "gateway_v6", None, ),
+        ( "routes", (
+            ( "routes", None, lambda route: ( cidr(route["route"], route["netmask"]), route["gateway"], "ipv4", ), ), # Should be ipv4 but need to verify ... # pylint: disable=C0301
+            ), ),
+        )
+
+_SCALAR_VERSIONS = {
+        "gateway": "ipv4",
+        "gateway_v6": "ipv6",
+        }
+
+def merge(message, entries, hostname = None):
+    """Merge the networking entries of a resetnetwork into message.
+
+    ### Arguments
+
+    Argument | Description
+    -------- | -----------
+    message  | The translated resetnetwork message.
+    entries  | The raw (untranslated) entries of the networking prefix.
+    hostname | The hostname found alongside the entries (if any).
+
+    ### Description
+
+    Each entry is translated and its ips and routes are added to those
+    already in message; everything else in the entry replaces the value in
+    message.  Returns message.
+
+    """
+
+    for item in entries:
+        tmp = translate(item)
+
+        logger.debug("Adding in items: %s", tmp)
+
+        if "ips" in tmp:
+            if "ips" not in message:
+                message["ips"] = {}
+            message["ips"].update(tmp.pop("ips"))
+
+        if "routes" in tmp:
+            if "routes" not in message:
+                message["routes"] = {}
+            message["routes"].update(tmp.pop("routes"))
+
+        message.update(tmp)
+
+        logger.debug("Message: %s", message)
+
+    logger.debug("Found the hostname: %s", hostname)
+
+    if hostname is not None:
+        message["hostname"] = hostname
+
+    return message
+
 def interface(mac_address):
-    """The interface name for the given MAC address."""
+    """The interface name for the given MAC address.
 
-    # TODO Merge with mac_addresses?
-    # TODO Other OS's?
+    ### Description
 
-    sys_net = os.path.join(os.path.sep, "sys", "class", "net")
+    Looked up in the index shared with macs (see _index); an unknown MAC
+    rebuilds the index once before giving up with a KeyError.
 
-    nics = {}
-    for nic in os.listdir(sys_net):
-        with open(os.path.join(sys_net, nic, "address")) as mac:
-            nics[mac.read().strip().lower()] = nic
+    """
 
-    logger.debug("Found MACs: %s", nics)
+    mac_address = mac_address.lower()
+
+    nics = _index()[0]
 
-    return nics[mac_address.lower()]
+    if mac_address not in nics:
+        nics = _index(rebuild = True)[0]
+
+    return nics[mac_address]
 
 def cidr(ip, netmask): # pylint: disable=C0103
     """Converts an IP and Netmask into CIDR notation."""
@@ -302,15 +359,157 @@ def cidr(ip, netmask): # pylint: disable=C0103
 def macs():
     """Gets all mac addresses on the system."""
 
-    # TODO Merge with interface()?
+    return list(_index()[1])
+
+_INDEX = None
+_INDEX_LOCK = threading.Lock()
+_LISTENING = []
+
+def _index(rebuild = False):
+    """The MAC address index: ({ mac: interface }, [ mac per interface ]).
+
+    ### Description
+
+    Built from /sys/class/net (one read of every address file) and kept
+    until a netlink RTM_NEWLINK or RTM_DELLINK message (an interface added,
+    removed, renamed or changed) arrives.  If the netlink listener can't be
+    started (i.e. not Linux) nothing is cached and every call scans sysfs.
+
+    """
+
+    global _INDEX # pylint: disable=W0603
+
+    with _INDEX_LOCK:
+        if not len(_LISTENING) or _LISTENING[0][0] != os.getpid(): # The listener doesn't survive a fork (i.e. daemonizing). # pylint: disable=C0301
+            _LISTENING[:] = [ ( os.getpid(), _listen(), ) ]
+            _INDEX = None
+
+        index = _INDEX
+
+        if index is None or rebuild or not _LISTENING[0][1]:
+            index = _scan()
+
+            if _LISTENING[0][1]:
+                _INDEX = index
+
+        return index
+
+def _scan():
     # TODO Other OS's?
 
     sys_net = os.path.join(os.path.sep, "sys", "class", "net")
 
+    nics = {}
     macs = [] # pylint: disable=W0621
+
     for nic in os.listdir(sys_net):
         with open(os.path.join(sys_net, nic, "address")) as mac:
-            macs.append(mac.read().strip().lower())
+            address = mac.read().strip().lower()
+
+        nics[address] = nic
+        macs.append(address)
+
+    logger.debug("Found MACs: %s", nics)
+
+    return nics, macs
+
+NETLINK_ROUTE = 0
+RTMGRP_LINK = 1
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+
+def _listen():
+    """Start the thread clearing the index on link changes (True if started)."""
+
+    try:
+        listener = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE) # pylint: disable=E1101,C0301
+        listener.bind((0, RTMGRP_LINK))
+    except (AttributeError, socket.error) as error:
+        logger.info("Not caching MAC addresses; no netlink: %s", error)
+        return False
+
+    def invalidate():
+        """Drop the index whenever a link is added, removed or changed.
+
+        ### Description
+
+        ENOBUFS (messages were lost) drops the index as well.  Any other error
+        stops the listener and lookups go back to scanning sysfs every time.
+
+        """
+
+        global _INDEX # pylint: disable=W0603
+
+        while True:
+            try:
+                data = listener.recv(65536)
+            except socket.error as error:
+                if error.errno == errno.EINTR:
+                    continue
+
+                if error.errno != errno.ENOBUFS:
+                    logger.warning("Netlink error, %s; no longer caching MAC addresses", error) # pylint: disable=C0301
+
+                    with _INDEX_LOCK:
+                        _INDEX = None
+
+                        if len(_LISTENING) and _LISTENING[0][0] == os.getpid():
+                            _LISTENING[0] = ( os.getpid(), False, )
+
+                    listener.close()
+
+                    return
+
+                logger.debug("Netlink overrun, %s; dropping the MAC index", error) # pylint: disable=C0301
+                data = struct.pack("=IHHII", 16, RTM_NEWLINK, 0, 0, 0)
+
+            offset = 0
+            while offset + 16 <= len(data):
+                length, kind = struct.unpack_from("=IH", data, offset)
+
+                if kind in [ RTM_NEWLINK, RTM_DELLINK, ]:
+                    logger.debug("Link changed; dropping the MAC index")
+
+                    with _INDEX_LOCK:
+                        _INDEX = None
+
+                    break
+
+                offset += max(16, (length + 3) & ~3)
+
+    thread = threading.Thread(target = invalidate, name = "singularity-netlink") # pylint: disable=C0301
+    thread.daemon = True
+    thread.start()
+
+    return True
+
+
+def listen_fds():
+    """Listening sockets passed by the init system (socket activation).
+
+    ### Description
+
+    Returns the file descriptors (starting at 3) announced by LISTEN_FDS if
+    LISTEN_PID is this process and removes both from the environment so
+    commands run by configurators don't see them.  Must be called before the
+    daemon detaches (which changes its pid).
+
+    """
+
+    fds = []
+
+    if os.environ.get("LISTEN_PID") == str(os.getpid()):
+        try:
+            fds = range(LISTEN_FDS_START, LISTEN_FDS_START + int(os.environ.get("LISTEN_FDS", 0))) # pylint: disable=C0301
+        except ValueError:
+            logger.warning("Ignoring LISTEN_FDS, %s", os.environ.get("LISTEN_FDS")) # pylint: disable=C0301
+
+    for name in [ "LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES", ]:
+        os.environ.pop(name, None)
+
+    for fd in fds: # pylint: disable=C0103
+        fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC) # pylint: disable=C0301
 
-    return macs
+    logger.debug("Listening file descriptors from the init system: %s", fds)
 
+    return fds
@@ -0,0 +1,93 @@
+# Copyright (C) 2012 by Alex Brandt <alunduil@alunduil.com>
+#
+# singularity is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Record the traffic a communicator receives for scripts/replay.
+
+### Description
+
+Each message received is appended to the recording as a line of JSON:
+
+{
+  "time": 1357000000.123,
+  "identifier": "1357000000-1",
+  "payload": "{\"name\": \"resetnetwork\", \"value\": \"\"}",
+  "networking": [ "{\"label\": \"public\", ...}" ],
+  "hostname": "slice21006919"
+}
+
+The payload is exactly what the hypervisor handed the communicator (before
+translate); networking and hostname are only present for resetnetwork
+messages.  Password values are replaced by REDACTED before they are written.
+
+"""
+
+import logging
+import json
+import threading
+import time
+
+logger = logging.getLogger(__name__) # pylint: disable=C0103
+
+REDACTED = "redacted"
+
+class Recorder(object):
+    def __init__(self, path):
+        """Append the messages passed to this recorder to path."""
+
+        logger.info("Recording received messages to %s", path)
+
+        self._lock = threading.Lock()
+        self._file = open(path, "a")
+
+    def __call__(self, identifier, payload, **kwargs):
+        entry = {
+                "time": time.time(),
+                "identifier": identifier,
+                "payload": redact(payload),
+                }
+
+        entry.update(kwargs)
+
+        line = json.dumps(entry) + "\n"
+
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+def redact(payload):
+    """The payload with any password value replaced by REDACTED."""
+
+    message = payload
+
+    if isinstance(payload, basestring):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return payload
+
+    if not isinstance(message, dict):
+        return payload
+
+    if message.get("name") == "password" or message.get("function") == "password": # pylint: disable=C0301
+        message = dict(message)
+
+        for key in ( "value", "arguments", "password", ):
+            if key in message:
+                message[key] = REDACTED
+
+        if isinstance(payload, basestring):
+            return json.dumps(message)
+
+        return message
+
+    return payload
+
+def load(path):
+    """The entries recorded in path in the order they were received."""
+
+    with open(path, "r") as recording:
+        for line in recording:
+            if len(line.strip()):
+                yield json.loads(line)
@@ -3,65 +3,327 @@
 # singularity is freely distributable under the terms of an MIT-style license.
 # See COPYING or http://www.opensource.org/licenses/mit-license.php.
 
+"""Unix socket communicator for boxes without a hypervisor bus.
+
+### Description
+
+A client connects to the socket, writes a message (lines of JSON ended by a
+blank line or by shutting down its side of the connection) and reads the
+response ({"returncode": ..., "message": ...}) before the connection is
+closed.
+
+Many clients may be connected at once: a thread multiplexes the listening
+socket and every connection with epoll (poll where there is no epoll),
+reading whatever has arrived without blocking and queueing each complete
+message for receive.  A client that is slow to write (or never finishes)
+only holds its own connection; it is closed after READ_TIMEOUT seconds.
+The identifier receive returns names the connection so send answers the
+client that asked, in whatever order the responses are ready.
+
+"""
+
+import errno
 import logging
 import os
+import select
 import socket
 import json
+import itertools
+import sys
+import threading
+import time
 
+import singularity.communicators.bounded as bounded
 import singularity.communicators.helpers as helpers
 
+from singularity import metrics
 from singularity.communicators import Communicator
 from singularity.parameters import SingularityParameters
 
 logger = logging.getLogger(__name__) # pylint: disable=C0103
 
+READ_TIMEOUT = 60 # Seconds a client has to write its message.
+MAXIMUM_MESSAGE = 1 << 20 # Bytes; larger messages close the connection.
+
+_RETRY = [ errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR, ]
+
+class _Poller(object):
+    """The parts of select.epoll used here with a select.poll fallback."""
+
+    def __init__(self):
+        self._epoll = hasattr(select, "epoll")
+
+        if self._epoll:
+            self._poller = select.epoll()
+            self.READ = select.EPOLLIN | select.EPOLLERR | select.EPOLLHUP # pylint: disable=C0103,E1101,C0301
+        else:
+            self._poller = select.poll()
+            self.READ = select.POLLIN | select.POLLERR | select.POLLHUP # pylint: disable=C0103
+
+    def register(self, fd): # pylint: disable=C0103
+        self._poller.register(fd, self.READ)
+
+    def unregister(self, fd): # pylint: disable=C0103
+        try:
+            self._poller.unregister(fd)
+        except (KeyError, IOError, OSError):
+            pass
+
+    def poll(self, timeout):
+        """Ready (fd, events) waiting at most timeout seconds."""
+
+        try:
+            if self._epoll:
+                return self._poller.poll(timeout)
+            return self._poller.poll(timeout * 1000)
+        except (IOError, OSError, select.error) as error:
+            if error.args[0] != errno.EINTR:
+                raise
+            return []
+
+class _Connection(object):
+    """A client connection and the part of its message read so far."""
+
+    def __init__(self, connection, identifier):
+        self.socket = connection
+        self.identifier = identifier
+        self.accepted = time.time()
+
+        self.buffer = ""
+        self.message = ""
+
+    def read(self):
+        """Read what has arrived; True once the message is complete.
+
+        ### Description
+
+        Lines are stripped and joined; a blank line (or the client shutting
+        down its side) ends the message.  Raises socket.error if the client
+        went away.
+
+        """
+
+        try:
+            data = self.socket.recv(4096)
+        except socket.error as error:
+            if error.errno in _RETRY:
+                return False
+            raise
+
+        self.buffer += data
+
+        while "\n" in self.buffer:
+            line, self.buffer = self.buffer.split("\n", 1)
+            line = line.strip()
+
+            if not len(line): # Blank line separates messages ...
+                return True
+
+            self.message += line
+
+        if not len(data):
+            self.message += self.buffer.strip()
+            return True
+
+        if len(self.message) + len(self.buffer) > MAXIMUM_MESSAGE:
+            raise socket.error(errno.EMSGSIZE, "message larger than {0} bytes".format(MAXIMUM_MESSAGE)) # pylint: disable=C0301
+
+        return False
+
 class SocketCommunicator(Communicator):
-    def __init__(self, path = None, *args, **kwargs):
+    def __init__(self, path = None, inherited = None, *args, **kwargs):
         super(SocketCommunicator, self).__init__(*args, **kwargs)
 
         path = path or SingularityParameters()["socket_communicator.path"] or os.path.join(SingularityParameters()["main.cache"], "singularity.sock") # pylint: disable=C0301
 
-        logger.info("Setting up socket at %s", path)
+        if inherited is not None and len(inherited[1]):
+            logger.info("Using the socket handed over for %s", path)
 
-        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket = socket.fromfd(inherited[1][0], socket.AF_UNIX, socket.SOCK_STREAM) # pylint: disable=C0301
+            os.close(inherited[1][0])
+        else:
+            logger.info("Setting up socket at %s", path)
 
-        if os.access(path, os.W_OK):
-            os.remove(path)
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
 
-        self.socket.bind(path)
-        self.socket.listen(0) # To best emulate a hypervisor we only allow one connection. # pylint: disable=C0301
-        self.connection = None
+            if os.access(path, os.W_OK):
+                os.remove(path)
+
+            self.socket.bind(path)
+            self.socket.listen(socket.SOMAXCONN)
+
+        self.socket.setblocking(0)
+
+        self._identifiers = itertools.count()
+
+        # Connections with a message queued or being handled (identifier =>
+        # socket) shared with the workers calling send.
+        self.connections = {}
+        self._lock = threading.Lock()
+
+        # Connections still being read (fd => _Connection); only touched by
+        # the loop thread.
+        self._reading = {}
+
+        self._queue = bounded.create()
+        self._supersedable = bounded.supersedable()
+
+        metrics.gauge("singularity_communicator_queue_high_water", lambda: self._queue.high_water) # pylint: disable=C0301
+
+        self._paused = threading.Event()
+
+        self._poller = _Poller()
+        self._poller.register(self.socket.fileno())
+
+        thread = threading.Thread(target = self._loop, name = "singularity-socket") # pylint: disable=C0301
+        thread.daemon = True
+        thread.start()
 
     def __del__(self):
-        self.connection.close()
+        for connection in self.connections.values():
+            connection.close()
+
+    @property
+    def depth(self):
+        """Messages queued plus connections whose message is being read."""
+        return self._queue.qsize() + len(self._reading)
+
+    def _loop(self):
+        """Accept connections and read messages until the process exits."""
+
+        listening = True
+
+        while True:
+            if listening and self._paused.is_set():
+                self._poller.unregister(self.socket.fileno())
+                listening = False
+
+            for fd, events in self._poller.poll(1.0): # pylint: disable=C0103,W0612,C0301
+                try:
+                    if fd == self.socket.fileno():
+                        if listening and not self._paused.is_set():
+                            self._accept()
+                    elif fd in self._reading:
+                        self._read(fd)
+                except Exception as error: # pylint: disable=W0703
+                    logger.exception(error)
+
+            expired = time.time() - READ_TIMEOUT
+
+            for fd, connection in self._reading.items(): # pylint: disable=C0103
+                if connection.accepted < expired:
+                    logger.warning("Closing connection, %s, no message after %s seconds", connection.identifier, READ_TIMEOUT) # pylint: disable=C0301
+                    self._drop(fd)
+
+    def _accept(self):
+        """Accept every pending connection."""
+
+        while True:
+            try:
+                connection, address = self.socket.accept() # pylint: disable=W0612
+            except socket.error as error:
+                if error.errno in _RETRY + [ errno.ECONNABORTED, ]:
+                    return
+                raise
+
+            connection.setblocking(0)
+
+            identifier = str(next(self._identifiers))
+
+            logger.debug("Accepted connection, %s", identifier)
+
+            self._reading[connection.fileno()] = _Connection(connection, identifier) # pylint: disable=C0301
+            self._poller.register(connection.fileno())
+
+    def _read(self, fd): # pylint: disable=C0103
+        """Read from the connection fd and queue its message once complete."""
+
+        connection = self._reading[fd]
+
+        try:
+            if not connection.read():
+                return
+        except socket.error as error:
+            logger.warning("Closing connection, %s: %s", connection.identifier, error) # pylint: disable=C0301
+            self._drop(fd)
+            return
+
+        if not len(connection.message):
+            logger.debug("Closing connection, %s, without a message", connection.identifier) # pylint: disable=C0301
+            self._drop(fd)
+            return
+
+        self._poller.unregister(fd)
+        del self._reading[fd]
+
+        logger.info("Got message, %s, from the user.", connection.message)
+
+        connection.socket.setblocking(1)
+
+        with self._lock:
+            self.connections[connection.identifier] = connection.socket
+
+        refused = self._queue.put((connection.identifier, connection.message), victim = self._supersedable) # pylint: disable=C0301
+
+        if refused is None or refused[0] != connection.identifier:
+            metrics.increment("singularity_communicator_enqueued_total")
+
+        if refused is not None:
+            logger.warning("Queue is full (%s requests); answering %s with busy", self._queue.maxsize, refused[0]) # pylint: disable=C0301
+
+            metrics.increment("singularity_communicator_dropped_total", policy = self._queue.policy) # pylint: disable=C0301
+
+            self.send(refused[0], "busy", bounded.BUSY_STATUS)
+
+    def _drop(self, fd): # pylint: disable=C0103
+        """Forget and close a connection that is still being read."""
+
+        self._poller.unregister(fd)
+        self._reading.pop(fd).socket.close()
 
     def receive(self):
         """Recieve message from the user and package for upstream consumption
 
         ### Description
 
-        Wait for a connection and read a message.
+        Wait for a complete message from any client.  The identifier returned
+        names the connection the message arrived on so the response can be
+        sent back on it even when other messages have been received since.
 
         """
 
-        identifier = hash(self) # Purely for API consistency.
+        identifier, message = self._queue.get(timeout = sys.maxint)
 
-        self.connection, address = self.socket.accept() # pylint: disable=W0612
+        self.record(identifier, message)
 
-        message = ""
-        messages = self.connection.makefile("r")
-        while True:
-            piece = messages.readline().strip()
+        return identifier, helpers.translate(message)
 
-            if not len(piece): # Blank line separates messages ...
-                break
+    def pause(self):
+        """Stop accepting connections.
 
-            message += piece
-        messages.close()
+        ### Description
 
-        logger.info("Got message, %s, from the user.", message)
+        Connections already accepted are still read and answered; new ones
+        wait in the listen backlog for whoever holds the socket next.
 
-        return identifier, helpers.translate(message)
+        """
+
+        self._paused.set()
+
+    def handoff(self):
+        """Hand the listening socket to the new daemon.
+
+        ### Description
+
+        Both daemons hold the socket until the old one exits so no connection
+        is refused in between; the old daemon stops accepting and answers the
+        connections it already accepted.
+
+        """
+
+        self.pause()
+
+        return {}, [ self.socket.fileno() ]
 
     def send(self, identifier, message, status = 0):
         """Send the passed message to the user.
@@ -69,20 +331,32 @@ class SocketCommunicator(Communicator):
         ### Description
 
         Send the message to the user and wait for confirmation that
-        evertyhing was successful.
+        evertyhing was successful.  The connection the message was received on
+        is closed once the response is sent.
 
         """
 
         logger.info("Sending message, %s", message)
 
+        with self._lock:
+            connection = self.connections.pop(identifier, None)
+
+        if connection is None:
+            logger.warning("No connection for identifier, %s", identifier)
+            return
+
         message = json.dumps({
             "returncode": status,
             "message": message,
             })
 
         try:
-            self.connection.send(message) # This method does exist! I swear! pylint: disable=E1101,C0301
+            connection.settimeout(READ_TIMEOUT) # A client that stops reading can't hold a worker forever. # pylint: disable=C0301
+            connection.sendall(message) # This method does exist! I swear! pylint: disable=E1101,C0301
+        except socket.timeout:
+            logger.warning("Timed out sending the response to, %s", identifier)
         except socket.error as error:
-            if error.errno != 32: # No listener present!
+            if error.errno not in [ errno.EPIPE, errno.ECONNRESET, ]: # No listener present! # pylint: disable=C0301
                 raise
-
+        finally:
+            connection.close()
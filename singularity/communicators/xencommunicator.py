@@ -7,15 +7,16 @@ import logging
 import json
 import Queue
 import sys
-
-import xen.xend.xenstore.xsutil as xs # pylint: disable=F0401
-
-from xen.xend.xenstore.xswatch import xswatch # pylint: disable=F0401
+import threading
+import time
 
 import singularity.communicators.helpers as helpers
 
+from singularity import metrics
 from singularity.communicators import Communicator
-from singularity.helpers import crypto
+import singularity.communicators.bounded as bounded
+
+from singularity.parameters import SingularityParameters
 from singularity.configurators.features import FeaturesConfigurator
 
 logger = logging.getLogger(__name__) # pylint: disable=C0103
@@ -207,9 +208,20 @@ class XenCommunicator(Communicator):
     Hostname is available in vm-data/hostname.
     IP information is available in vm-data/networking.
 
+    At most daemon.queuesize requests wait to be received.  Once that many
+    are waiting daemon.overflow decides what happens to the next one (see
+    singularity.communicators.bounded); a request that is not queued is
+    answered with BUSY_STATUS so the host retries it later.
+
+    Requests stay in xenstore until the daemon has journaled them (see
+    accepted) so a daemon that dies before then (i.e. while resetnetwork
+    waits for networking) finds them again when it starts.
+
     """
 
-    def __init__(self, receive_prefix = "data/host", send_prefix = "data/guest", data_prefix = "vm-data", *args, **kwargs): # pylint: disable=C0301
+    durable = True
+
+    def __init__(self, receive_prefix = "data/host", send_prefix = "data/guest", data_prefix = "vm-data", inherited = None, *args, **kwargs): # pylint: disable=C0301
         """Initialize a communication "bus" with the Xen Hypervisor.
 
         ### Description
@@ -221,12 +233,38 @@ class XenCommunicator(Communicator):
 
         super(XenCommunicator, self).__init__(*args, **kwargs)
 
+        # The xen bindings are only needed (and imported) once on Xen.
+        import xen.xend.xenstore.xsutil as xs # pylint: disable=F0401
+
+        from xen.xend.xenstore.xswatch import xswatch # pylint: disable=F0401
+
         self._receive_prefix = receive_prefix
         self._send_prefix = send_prefix
         self._network_prefix = data_prefix + "/networking"
         self._hostname_prefix = data_prefix + "/hostname"
 
-        self._queue = Queue.Queue()
+        self._queue = bounded.create()
+
+        metrics.gauge("singularity_communicator_queue_high_water", lambda: self._queue.high_water) # pylint: disable=C0301
+
+        supersedable = bounded.supersedable()
+
+        # Requests read from xenstore but not yet removed (i.e. queued or
+        # being received) and those the daemon handing over is still
+        # receiving; guarded by self._requests_lock.
+        self._requests = set()
+        self._elsewhere = set()
+        self._requests_lock = threading.Lock()
+
+        if inherited is not None:
+            self._elsewhere.update([ str(path) for path in inherited[0].get("receiving", []) ]) # pylint: disable=C0301
+
+            for path, message in inherited[0].get("queue", []):
+                if isinstance(message, unicode):
+                    message = message.encode("utf-8") # receive expects str.
+
+                self._requests.add(str(path))
+                self._queue.put((str(path), message), force = True)
 
         self.xs = xs.xshandle() # pylint: disable=C0103
 
@@ -236,22 +274,92 @@ class XenCommunicator(Communicator):
             if path in [ self._receive_prefix, data_prefix ]:
                 return True
 
+            with self._requests_lock:
+                if path in self._requests: # Already queued.
+                    return True
+
+                if path in self._elsewhere: # The old daemon answers it.
+                    return True
+
+                self._requests.add(path)
+
             transaction = self.xs.transaction_start()
             message = self.xs.read(transaction, path)
             self.xs.transaction_end(transaction)
 
+            if message is None: # Removed (i.e. the watch firing for our rm).
+                with self._requests_lock:
+                    self._requests.discard(path)
+
+                return True
+
             logger.info("Received message, %s", message)
 
-            self._queue.put((path, message))
+            refused = self._queue.put((path, message), victim = supersedable)
+
+            if refused is None or refused[0] != path:
+                metrics.increment("singularity_communicator_enqueued_total")
+
+            if refused is not None:
+                logger.warning("Queue is full (%s requests); answering %s with busy", self._queue.maxsize, refused[0]) # pylint: disable=C0301
+
+                metrics.increment("singularity_communicator_dropped_total", policy = self._queue.policy) # pylint: disable=C0301
+
+                self.send(refused[0].replace(self._receive_prefix + "/", ""), "busy", bounded.BUSY_STATUS) # pylint: disable=C0301
+                self._remove(refused[0])
+
+            return True
+
+        # Mirror of vm-data/networking (entry => value) and vm-data/hostname
+        # kept current by watches; guarded by (and changes notified on)
+        # self._networking.
+        self._networking = threading.Condition()
+        self._network_entries = {}
+        self._hostname = None
+
+        self._load_vm_data()
+
+        def network_watch(path):
+            logger.debug("Networking changed at %s", path)
+
+            if path == self._network_prefix:
+                self._load_vm_data()
+                return True
+
+            entry = path[len(self._network_prefix) + 1:].split("/")[0]
+
+            transaction = self.xs.transaction_start()
+            value = self.xs.read(transaction, self._network_prefix + "/" + entry) # pylint: disable=C0301
+            self.xs.transaction_end(transaction)
+
+            with self._networking:
+                if value is None:
+                    self._network_entries.pop(entry, None)
+                else:
+                    self._network_entries[entry] = value
+
+                self._networking.notify_all()
+
+            return True
+
+        def hostname_watch(path): # pylint: disable=W0613
+            logger.debug("Hostname changed")
 
             transaction = self.xs.transaction_start()
-            message = self.xs.rm(transaction, path)
+            value = self.xs.read(transaction, self._hostname_prefix)
             self.xs.transaction_end(transaction)
 
+            with self._networking:
+                self._hostname = value
+
             return True
 
+        self._request_watch = xswatch(self._receive_prefix, xs_watch)
+
         self.watches = []
-        self.watches.append(xswatch(self._receive_prefix, xs_watch))
+        self.watches.append(self._request_watch)
+        self.watches.append(xswatch(self._network_prefix, network_watch))
+        self.watches.append(xswatch(self._hostname_prefix, hostname_watch))
 
         transaction = self.xs.transaction_start()
         entries = self.xs.ls(transaction, self._receive_prefix)
@@ -263,11 +371,138 @@ class XenCommunicator(Communicator):
             for path in [ self._receive_prefix + "/" + entry for entry in entries ]: # pylint: disable=C0301
                 xs_watch(path)
 
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
     def __del__(self):
         logger.info("XenCommunicator watches are being removed.")
         for watch in self.watches:
             watch.unwatch()
 
+    def _remove(self, path):
+        """Remove the request at path from xenstore (it has been taken)."""
+
+        transaction = self.xs.transaction_start()
+        self.xs.rm(transaction, path)
+        self.xs.transaction_end(transaction)
+
+        with self._requests_lock: # Only after the rm so the watch ignores it.
+            self._requests.discard(path)
+
+    def accepted(self, identifier):
+        """Remove the request for identifier from xenstore."""
+
+        self._remove(self._receive_prefix + "/" + identifier)
+
+    def pause(self):
+        """Stop watching xenstore for requests.
+
+        ### Description
+
+        Requests that arrive after the watch is removed stay in xenstore and
+        are picked up by the next daemon's initial scan.
+
+        """
+
+        if self._request_watch in self.watches:
+            self._request_watch.unwatch()
+            self.watches.remove(self._request_watch)
+
+    def handoff(self):
+        """Stop watching xenstore and hand over the queued messages.
+
+        ### Description
+
+        The requests this daemon is still receiving (i.e. waiting for
+        networking) are named as well so the new daemon leaves them to it.
+
+        """
+
+        self.pause()
+
+        queue = []
+
+        while True:
+            try:
+                queue.append(self._queue.get_nowait())
+            except Queue.Empty:
+                break
+
+        with self._requests_lock:
+            receiving = sorted(self._requests - set([ path for path, message in queue ])) # pylint: disable=W0612,C0301
+
+        return { "queue": queue, "receiving": receiving, }, []
+
+    def _load_vm_data(self):
+        """Read vm-data/networking and vm-data/hostname into the mirror.
+
+        ### Description
+
+        Everything is read in one transaction; afterwards the watches keep
+        the mirror current one entry at a time.
+
+        """
+
+        transaction = self.xs.transaction_start()
+
+        entries = self.xs.ls(transaction, self._network_prefix) or []
+        networking = dict([ (entry, self.xs.read(transaction, self._network_prefix + "/" + entry)) for entry in entries ]) # pylint: disable=C0301
+
+        hostname = None
+        if self.xs.ls(transaction, self._hostname_prefix) is not None:
+            hostname = self.xs.read(transaction, self._hostname_prefix)
+
+        self.xs.transaction_end(transaction)
+
+        logger.debug("Loaded vm-data: networking, %s; hostname, %s", networking, hostname) # pylint: disable=C0301
+
+        with self._networking:
+            self._network_entries = dict([ (entry, value) for entry, value in networking.iteritems() if value is not None ]) # pylint: disable=C0301
+            self._hostname = hostname
+
+            self._networking.notify_all()
+
+    def _wait_for_networking(self, macs):
+        """Networking entries (entry => value) once every MAC has one.
+
+        ### Description
+
+        The host may still be writing vm-data/networking when resetnetwork
+        arrives.  The mirror is updated by the networking watch so we wait
+        for it to change and check again after each change.  After
+        daemon.networkwait seconds the mirror is read from xenstore once more
+        (in case a watch was missed) and we go ahead with the entries there
+        are.
+
+        """
+
+        # MAC Addresses are upper in next gen but lower in first gen
+        # Why do things like this happen?
+
+        macs = set([ mac.lower() for mac in macs ])
+
+        deadline = time.time() + float(SingularityParameters()["daemon.networkwait"] or 0) # pylint: disable=C0301
+
+        with self._networking:
+            while set([ entry.lower() for entry in self._network_entries ]) < macs: # Required since we can't assume anything about the entries coming back ... # pylint: disable=C0301
+                remaining = deadline - time.time()
+
+                if remaining <= 0:
+                    break
+
+                self._networking.wait(remaining)
+            else:
+                return dict(self._network_entries)
+
+        self._load_vm_data()
+
+        with self._networking:
+            if set([ entry.lower() for entry in self._network_entries ]) < macs: # pylint: disable=C0301
+                logger.warning("Networking entries, %s, missing MACs after %s seconds; continuing without them", sorted(self._network_entries), SingularityParameters()["daemon.networkwait"]) # pylint: disable=C0301
+
+            return dict(self._network_entries)
+
     def receive(self): # pylint: disable=R0912
         """Recieve message from hypervisor and package for upstream consumption
 
@@ -289,6 +524,9 @@ class XenCommunicator(Communicator):
         logger.info("Translating message: %s", message)
         logger.info("Type of message: %s", type(message))
 
+        payload = message
+        extras = {}
+
         if type(message) is str:
             message = helpers.translate(message)
 
@@ -302,80 +540,52 @@ class XenCommunicator(Communicator):
                 macs = set([ mac.replace(":", "") for mac in helpers.macs() if int(mac.replace(":", ""), 16) ]) # pylint: disable=C0301
                 logger.debug("MAC Addresses: %s", macs)
 
-                # TODO Is there a better way than a busy wait?
-                # MAC Addresses are upper in next gen but lower in first gen
-                # Why do things like this happen?
+                entries = self._wait_for_networking(macs)
 
-                entries = set()
-                while set([ entry.lower() for entry in entries ]) < set([ mac.lower() for mac in macs ]): # Required since we can't assume anything about the entries coming back ... pylint: disable=C0301
-                    transaction = self.xs.transaction_start()
-                    entries = set(self.xs.ls(transaction, self._network_prefix))
-                    self.xs.transaction_end(transaction)
+                logger.debug("Entries: %s", entries)
 
-                    logger.debug("Entries: %s", entries)
-
-                for entry in entries:
-                    transaction = self.xs.transaction_start()
-                    msg.append(self.xs.read(transaction, self._network_prefix + "/" + entry)) # pylint: disable=C0301
-                    self.xs.transaction_end(transaction)
+                msg.extend(entries.values())
 
                 logger.debug("Message: %s", message)
 
-                for item in msg:
-                    tmp = helpers.translate(item)
-
-                    logger.debug("Adding in items: %s", tmp)
-
-                    if "ips" in tmp:
-                        if "ips" not in message:
-                            message["ips"] = {}
-                        message["ips"].update(tmp.pop("ips"))
-
-                    if "routes" in tmp:
-                        if "routes" not in message:
-                            message["routes"] = {}
-                        message["routes"].update(tmp.pop("routes"))
-
-                    message.update(tmp)
+                with self._networking:
+                    hostname = self._hostname
 
-                    logger.debug("Message: %s", message)
-                
-                msg = None
+                helpers.merge(message, msg, hostname)
 
-                transaction = self.xs.transaction_start()
-                if self.xs.ls(transaction, self._hostname_prefix) is not None:
-                    msg = self.xs.read(transaction, self._hostname_prefix)
-                self.xs.transaction_end(transaction)
+                extras["networking"] = msg
+                extras["hostname"] = hostname
 
-                logger.debug("Found the hostname: %s", msg)
+            elif message["function"] in helpers.FUNCTION_NAMES:
+                message["function"] = helpers.FUNCTION_NAMES[message["function"]] # pylint: disable=C0301
 
-                if msg is not None:
-                    message["hostname"] = msg
-
-            elif message["function"] == "injectfile":
-                message["function"] = "file"
+            elif message["function"] == "keyinit":
+                from singularity.helpers import crypto # Pulls in pycrypto.
 
-            elif message["function"] == "agentupdate":
-                message["function"] = "update"
+                self.record(identifier, payload)
 
-            elif message["function"] == "keyinit":
                 crypto.generate_keys(message["arguments"])
 
                 logger.debug("Type of the key: %s", type(crypto.PUBLIC_KEY))
 
                 self.send(identifier, str(crypto.PUBLIC_KEY), "D0")
+                self._remove(path)
                 return self.receive() # Hoping it's not keyinit's all the way down ... # pylint: disable=C0301
 
             elif message["function"] == "password":
+                from singularity.helpers import crypto # Pulls in pycrypto.
+
                 if crypto.AES_KEYS is not None:
                     logger.info("Decrypting password")
                     message["password"] = crypto.decrypt(message["arguments"])
                     logger.debug("Password: encrypted => %s; decrypted => %s", message["arguments"], message["password"]) # pylint: disable=C0301
                     crypto.AES_KEYS = None
                 else:
-                    self._queue.put((path, message))
+                    self._queue.put((path, message), force = True)
                     return self.receive() # Potential for busy loop with itself if no keyinit ever comes ... # pylint: disable=C0301
 
+        self.record(identifier, payload, **extras)
+
         logger.debug("Passing back identifier, %s, message, %s", identifier, message) # pylint: disable=C0301
 
         return identifier, message
@@ -434,4 +644,3 @@ class XenCommunicator(Communicator):
         transaction = self.xs.transaction_start()
         self.xs.write(transaction, self._send_prefix + "/" + identifier, message) # pylint: disable=C0301
         self.xs.transaction_end(transaction)
-
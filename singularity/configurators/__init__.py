@@ -9,6 +9,7 @@ import re
 import sys
 import inspect
 import copy
+import hashlib
 import itertools
 import importlib
 
@@ -63,6 +64,65 @@ class SingularityConfigurator(object):
         logger.debug("Probable function: %s", self.__class__.__name__.replace("Configurator", "").lower()) # pylint: disable=C0301
         return self.__class__.__name__.replace("Configurator", "").lower()
 
+    @property
+    def message_functions(self): # pylint: disable=R0201
+        """Values of the message's function this configurator consumes.
+
+        ### Description
+
+        Returns the values of the "function" key in a message (i.e. "version"
+        or "file") that this configurator can handle.  Along with
+        SingularityConfigurator.message_keys this lets Singularity index the
+        configurators and only ask the ones that could apply to a message if
+        they are runnable.
+
+        ### Default Value
+
+        None; the configurator is not restricted to any function value.
+
+        """
+
+        return None
+
+    @property
+    def message_keys(self): # pylint: disable=R0201
+        """Keys that must be present in a message for this configurator.
+
+        ### Description
+
+        Returns the keys (see SingularityConfigurator.runnable for the
+        available keys) that a message must contain before this configurator
+        can handle it.
+
+        ### Default Value
+
+        None; the configurator does not declare any required keys.  A
+        configurator that declares neither message_functions nor message_keys
+        is asked if it is runnable for every message.
+
+        """
+
+        return None
+
+    @property
+    def long_running(self): # pylint: disable=R0201
+        """True if content may take long enough to hold up other messages.
+
+        ### Description
+
+        Messages handled by a long running configurator (i.e. an update) are
+        answered straight away with a job identifier and handled in the
+        background by singularity.jobs.  The hypervisor can poll the job
+        with a "job" message (see JobConfigurator).
+
+        ### Default Value
+
+        False; content is run before the message is answered.
+
+        """
+
+        return False
+
     def runnable(self, configuration):
         """True if configurator can run on this system and in this context.
 
@@ -172,7 +232,32 @@ class SingularityConfigurators(object): # pylint: disable=R0903
 
         """
 
-        self._configurators = {}
+        self._modules = {}
+        self._instances = {}
+        self._configurators = []
+
+        # Modules this object loaded and then dropped (their file went away);
+        # if they come back their stale module object must be reloaded.
+        self._removed = set()
+
+        self.reload()
+
+    def reload(self):
+        """Bring the configurators up to date with the configurator path(s).
+
+        ### Description
+
+        Modules that have not been seen before are imported.  Modules already
+        loaded are only re-imported if the mtime of their source changed and
+        its SHA-1 digest differs from the one recorded when it was loaded.
+        The configurators of modules that disappeared are dropped.  Only the
+        configurators of new or changed modules are instantiated again.
+
+        The dispatch table is rebuilt afterwards (main.functions may have
+        changed as well).  Returns the names of the modules that were
+        (re)loaded or removed.
+
+        """
 
         mydir = os.path.abspath(os.path.dirname(__file__)) # Module's Directory
         self.path = [
@@ -187,6 +272,9 @@ class SingularityConfigurators(object): # pylint: disable=R0903
 
         logger.debug("SingularityConfigurator.path: %s", self.path)
 
+        found = set()
+        changed = set()
+
         for directory in self.path:
             logger.info("Searching %s for SingularityConfigurators ...", directory) # pylint: disable=C0301
 
@@ -212,29 +300,173 @@ class SingularityConfigurators(object): # pylint: disable=R0903
 
             logger.debug("Potential modules found: %s", module_names)
 
-            modules = []
-
             for module_name in module_names:
-                try:
-                    modules.append(importlib.import_module(module_name))
-                    logger.info("Module, %s, imported", module_name)
-                except ImportError:
-                    logger.warning("Module, %s, not able to be imported", module_name) # pylint: disable=C0301
-                    continue
+                found.add(module_name)
 
-            for module in modules:
-                logger.debug("Classes found in Module, %s: %s", module.__name__, inspect.getmembers(module, inspect.isclass)) # pylint: disable=C0301
+                if self._load(module_name):
+                    changed.add(module_name)
 
-                for object_ in [ class_() for name, class_ in inspect.getmembers(module, inspect.isclass) if issubclass(class_, SingularityConfigurator) and class_ != SingularityConfigurator]: # pylint: disable=C0301,W0612
-                    logger.debug("Found appropriate object, %s", object_)
-                    self._configurators[object_.__class__.__name__] = object_
+        for module_name in set(self._modules) - found:
+            logger.info("Module, %s, removed", module_name)
+            self._forget(module_name)
+            del self._modules[module_name]
+            self._removed.add(module_name)
+            changed.add(module_name)
 
-        logger.debug("Type of self._configurators: %s", type(self._configurators)) # pylint: disable=C0301
+        self._configurators = self._instances.values()
 
-        self._configurators = self._configurators.values()
+        global _FUNCTIONS # pylint: disable=W0603
+        _FUNCTIONS = frozenset([ configurator.function for configurator in self._configurators ]) # pylint: disable=C0301
 
         logger.info("SingularityConfigurators found: %s", self._configurators) # pylint: disable=C0301
 
+        self._index()
+
+        return changed
+
+    def _load(self, module_name):
+        """Import or re-import module_name if it is new or has changed.
+
+        ### Description
+
+        Returns True if the module's configurators were (re)instantiated.
+
+        """
+
+        record = self._modules.get(module_name)
+
+        if record is not None:
+            mtime = _mtime(record["path"])
+
+            if mtime == record["mtime"]:
+                return False
+
+            record["mtime"] = mtime
+
+            digest = _digest(record["path"])
+
+            if digest == record["digest"]:
+                logger.debug("Module, %s, touched but unchanged", module_name)
+                return False
+
+            logger.info("Module, %s, changed; reloading", module_name)
+
+            try:
+                module = reload(record["module"])
+            except Exception as error: # pylint: disable=W0703
+                logger.warning("Module, %s, not able to be reloaded: %s", module_name, error) # pylint: disable=C0301
+                return False
+        else:
+            try:
+                if module_name in self._removed and module_name in sys.modules: # Removed earlier and back again # pylint: disable=C0301
+                    module = reload(sys.modules[module_name])
+                elif module_name in sys.modules: # i.e. loaded by another instance # pylint: disable=C0301
+                    module = sys.modules[module_name]
+                else:
+                    module = importlib.import_module(module_name)
+                logger.info("Module, %s, imported", module_name)
+            except ImportError:
+                logger.warning("Module, %s, not able to be imported", module_name) # pylint: disable=C0301
+                return False
+
+        path = _source(module)
+
+        self._forget(module_name)
+        self._removed.discard(module_name)
+
+        self._modules[module_name] = {
+                "module": module,
+                "path": path,
+                "mtime": _mtime(path),
+                "digest": _digest(path),
+                "names": [],
+                }
+
+        logger.debug("Classes found in Module, %s: %s", module.__name__, inspect.getmembers(module, inspect.isclass)) # pylint: disable=C0301
+
+        for object_ in [ class_() for name, class_ in inspect.getmembers(module, inspect.isclass) if issubclass(class_, SingularityConfigurator) and class_ != SingularityConfigurator]: # pylint: disable=C0301,W0612
+            logger.debug("Found appropriate object, %s", object_)
+            self._instances[object_.__class__.__name__] = object_
+            self._modules[module_name]["names"].append(object_.__class__.__name__) # pylint: disable=C0301
+
+        return True
+
+    def _forget(self, module_name):
+        """Drop the configurators instantiated from module_name."""
+
+        if module_name not in self._modules:
+            return
+
+        for name in self._modules[module_name]["names"]:
+            self._instances.pop(name, None)
+
+    def _index(self):
+        """Build the dispatch table for SingularityConfigurators.dispatch.
+
+        ### Description
+
+        Only configurators whose function is in main.functions are indexed.
+        Each is filed under its message_functions if it declares any,
+        otherwise under the first of its message_keys, otherwise it is a
+        candidate for every message.
+
+        """
+
+        self.allowed = set([ func.strip() for func in SingularityParameters()["main.functions"].split(",") ]) # pylint: disable=C0301
+
+        self._by_function = {}
+        self._by_key = {}
+        self._wildcard = []
+
+        for position, configurator in enumerate(self._configurators):
+            if configurator.function not in self.allowed:
+                logger.info("Configurator, %s, is not allowed.", configurator) # pylint: disable=C0301
+                continue
+
+            entry = (position, configurator, tuple(configurator.message_keys or ())) # pylint: disable=C0301
+
+            if configurator.message_functions:
+                for function in configurator.message_functions:
+                    self._by_function.setdefault(function, []).append(entry)
+            elif configurator.message_keys:
+                self._by_key.setdefault(configurator.message_keys[0], []).append(entry) # pylint: disable=C0301
+            else:
+                self._wildcard.append(entry)
+
+        logger.debug("Configurators by function: %s", self._by_function)
+        logger.debug("Configurators by key: %s", self._by_key)
+        logger.debug("Configurators for all messages: %s", self._wildcard)
+
+    def dispatch(self, message):
+        """Allowed configurators that could handle the message.
+
+        ### Arguments
+
+        Argument | Description
+        -------- | -----------
+        message  | The message (see SingularityConfigurator.runnable).
+
+        ### Description
+
+        Looks the message up in the table built by
+        SingularityConfigurators._index and returns the matching configurators
+        in the order they were found.  The configurators returned must still
+        be checked with SingularityConfigurator.runnable.
+
+        """
+
+        entries = list(self._wildcard)
+
+        if "function" in message:
+            entries.extend(self._by_function.get(message["function"], []))
+
+        for key in message:
+            entries.extend(self._by_key.get(key, []))
+
+        entries.sort()
+
+        return [ configurator for position, configurator, keys in entries if all([ key in message for key in keys ]) ] # pylint: disable=C0301,W0612
+
     def __len__(self):
         return len(self._configurators)
 
@@ -253,3 +485,42 @@ class SingularityConfigurators(object): # pylint: disable=R0903
     def __contains__(self, item):
         return item in self._configurators
 
+_FUNCTIONS = None
+
+def functions():
+    """The functions of the configurators found last (by any instance).
+
+    ### Description
+
+    Cheap enough to call for every response (i.e. features); only finds the
+    configurators (once) if none have been found yet.
+
+    """
+
+    if _FUNCTIONS is None:
+        SingularityConfigurators()
+
+    return _FUNCTIONS
+
+def _source(module):
+    """The source file of module (its .py rather than its .pyc)."""
+
+    path = getattr(module, "__file__", None) or ""
+
+    if re.search(r"\.py[co]$", path) and os.path.exists(path[:-1]):
+        path = path[:-1]
+
+    return path
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+def _digest(path):
+    try:
+        with open(path, "rb") as source:
+            return hashlib.sha1(source.read()).hexdigest()
+    except IOError:
+        return None
@@ -11,6 +11,10 @@ from singularity.parameters import SingularityParameters
 logger = logging.getLogger("console") # pylint: disable=C0103
 
 class FeaturesConfigurator(SingularityConfigurator):
+    @property
+    def message_functions(self): # pylint: disable=R0201,C0111
+        return ( "features", )
+
     def runnable(self, configuration):
         """True if configurator can run on this system and in this context.
 
@@ -53,9 +57,9 @@ class FeaturesConfigurator(SingularityConfigurator):
 
         """
 
-        from singularity.configurators import SingularityConfigurators
+        from singularity.configurators import functions
 
-        actions = set([ configurator.function for configurator in SingularityConfigurators() ]) # pylint: disable=C0301
+        actions = set(functions())
 
         logger.debug("All the actions: %s", actions)
 
@@ -11,6 +11,14 @@ from singularity.configurators import SingularityConfigurator
 logger = logging.getLogger(__name__) # pylint: disable=C0103
 
 class FileConfigurator(SingularityConfigurator):
+    @property
+    def message_functions(self): # pylint: disable=R0201,C0111
+        return ( "file", )
+
+    @property
+    def message_keys(self): # pylint: disable=R0201,C0111
+        return ( "arguments", )
+
     def runnable(self, configuration):
         """True if configurator can run on this system and in this context.
 
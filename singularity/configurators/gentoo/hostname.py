@@ -19,6 +19,10 @@ class GentooHostnameConfigurator(SingularityConfigurator):
     def confd_hostname_path(self): # pylint: disable=R0201,C0111
         return os.path.join(os.path.sep, "etc", "conf.d", "hostname")
 
+    @property
+    def message_keys(self): # pylint: disable=R0201,C0111
+        return ( "hostname", )
+
     def runnable(self, configuration):
         """True if configurator can run on this system and in this context.
 
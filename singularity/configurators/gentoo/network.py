@@ -19,6 +19,10 @@ class GentooNetworkConfigurator(SingularityConfigurator):
     def confd_net_path(self): # pylint: disable=R0201,C0111
         return os.path.join(os.path.sep, "etc", "conf.d", "net")
 
+    @property
+    def message_keys(self): # pylint: disable=R0201,C0111
+        return ( "ips", "routes", )
+
     def runnable(self, configuration):
         """True if configurator can run on this system and in this context.
 
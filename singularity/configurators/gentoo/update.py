@@ -5,8 +5,8 @@
 
 import logging
 import os
-import subprocess
 
+from singularity import helpers
 from singularity.configurators import SingularityConfigurator
 
 logger = logging.getLogger(__name__) # pylint: disable=C0103
@@ -16,6 +16,14 @@ class GentooUpdateConfigurator(SingularityConfigurator):
     def function(self):
         return "update"
 
+    @property
+    def message_functions(self): # pylint: disable=R0201,C0111
+        return ( "update", )
+
+    @property
+    def long_running(self): # pylint: disable=R0201,C0111
+        return True
+
     def runnable(self, configuration):
         """True if configurator can run on this system and in this context.
 
@@ -45,12 +53,7 @@ class GentooUpdateConfigurator(SingularityConfigurator):
             logger.info("This command must be run as uid 0!")
             return False
 
-        self._emerge_path = None # pylint: disable=W0201
-
-        try:
-            self._emerge_path = subprocess.check_output("which emerge", shell = True).strip() # pylint: disable=C0301,W0201,E1103
-        except subprocess.CalledProcessError:
-            pass
+        self._emerge_path = helpers.which("emerge") # pylint: disable=W0201
 
         logger.debug("emerge path: %s", self._emerge_path)
 
@@ -78,7 +81,7 @@ class GentooUpdateConfigurator(SingularityConfigurator):
 
         command = [ self._emerge_path, "-1", "app-emulation/singularity" ]
 
-        subprocess.check_call(command)
+        helpers.check_call(command)
 
         return { "": "" }
 
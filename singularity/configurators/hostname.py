@@ -5,8 +5,8 @@
 
 import logging
 import os
-import subprocess
 
+from singularity import helpers
 from singularity.configurators import SingularityConfigurator
 
 logger = logging.getLogger(__name__) # pylint: disable=C0103
@@ -14,6 +14,10 @@ logger = logging.getLogger(__name__) # pylint: disable=C0103
 class HostnameConfigurator(SingularityConfigurator):
     """Common configurator actions for hostname functionality."""
 
+    @property
+    def message_keys(self): # pylint: disable=R0201,C0111
+        return ( "hostname", )
+
     def runnable(self, configuration):
         """True if configurator can run on this system and in this context.
 
@@ -39,12 +43,7 @@ class HostnameConfigurator(SingularityConfigurator):
             logger.info("This command must be run as uid 0!")
             return False
 
-        self._hostname_path = None # pylint: disable=W0201
-
-        try:
-            self._hostname_path = subprocess.check_output("which hostname", shell = True).strip() # pylint: disable=C0301,W0201,E1103
-        except subprocess.CalledProcessError:
-            pass
+        self._hostname_path = helpers.which("hostname") # pylint: disable=W0201
 
         logger.debug("hostname path: %s", self._hostname_path)
 
@@ -71,7 +70,7 @@ class HostnameConfigurator(SingularityConfigurator):
         """
 
         command = [ self._hostname_path, configuration["hostname"] ]
-        subprocess.check_call(command) # pylint: disable=C0301
+        helpers.check_call(command) # pylint: disable=C0301
 
         return { "": "" }
 
@@ -16,6 +16,10 @@ class HostsConfigurator(SingularityConfigurator):
     def hosts_path(self): # pylint: disable=R0201,C0111
         return os.path.join(os.path.sep, "etc", "hosts")
 
+    @property
+    def message_keys(self): # pylint: disable=R0201,C0111
+        return ( "hostname", )
+
     def runnable(self, configuration):
         """True if configurator can run on this system and in this context.
 
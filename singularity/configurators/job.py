@@ -0,0 +1,68 @@
+# Copyright (C) 2012 by Alex Brandt <alunduil@alunduil.com>
+#
+# singularity is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+import logging
+import json
+
+from singularity.configurators import SingularityConfigurator
+from singularity.jobs import SingularityJobs
+
+logger = logging.getLogger("console") # pylint: disable=C0103
+
+class JobConfigurator(SingularityConfigurator):
+    @property
+    def message_functions(self): # pylint: disable=R0201,C0111
+        return ( "job", )
+
+    def runnable(self, configuration):
+        """True if configurator can run on this system and in this context.
+
+        ### Arguments
+
+        Argument      | Description
+        --------      | -----------
+        configuration | Configuration items to be applied (dict)
+
+        ### Description
+
+        We should be able to run if the following conditions are true:
+        * Recieve a function of job
+
+        """
+
+        if "function" not in configuration:
+            logger.info("Must be passed a function in the message")
+            return False
+
+        if configuration["function"] != "job":
+            logger.info("Must be passed \"job\" as the function")
+            return False
+
+        logger.info("JobConfigurator is runnable!")
+        return True
+
+    def content(self, configuration):
+        """Generated content of this configurator as a dictionary.
+
+        ### Arguments
+
+        Argument      | Description
+        --------      | -----------
+        configuration | Configuration settings to be applied by this configurator (dict)
+
+        ### Description
+
+        Returns the status (see SingularityJob.status) of the job named by the
+        message's value as a JSON object.  An unknown job (never submitted,
+        forgotten or from before a restart) has the state unknown.
+
+        """
+
+        identifier = configuration.get("arguments")
+
+        if identifier not in SingularityJobs():
+            return { "message": json.dumps({ "id": identifier, "state": "unknown", }) } # pylint: disable=C0301
+
+        return { "message": json.dumps(SingularityJobs()[identifier].status) }
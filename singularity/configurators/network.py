@@ -5,8 +5,8 @@
 
 import logging
 import os
-import subprocess
 
+from singularity import helpers
 from singularity.configurators import SingularityConfigurator
 
 logger = logging.getLogger(__name__) # pylint: disable=C0103
@@ -14,6 +14,10 @@ logger = logging.getLogger(__name__) # pylint: disable=C0103
 class NetworkConfigurator(SingularityConfigurator):
     """Common configurator actions for network functionality."""
 
+    @property
+    def message_keys(self): # pylint: disable=R0201,C0111
+        return ( "ips", "routes", )
+
     def runnable(self, configuration):
         """True if configurator can run on this system and in this context.
 
@@ -43,12 +47,7 @@ class NetworkConfigurator(SingularityConfigurator):
             logger.info("This command must be run as uid 0!")
             return False
 
-        self._ip_path = None # pylint: disable=W0201
-
-        try:
-            self._ip_path = subprocess.check_output("which ip", shell = True).strip() # pylint: disable=C0301,W0201,E1103
-        except subprocess.CalledProcessError:
-            pass
+        self._ip_path = helpers.which("ip") # pylint: disable=W0201
 
         logger.debug("ip path: %s", self._ip_path)
 
@@ -70,29 +69,24 @@ class NetworkConfigurator(SingularityConfigurator):
 
         ### Description
 
-        Runs the ip commond on the information provided.
+        Runs the ip commond on the information provided.  The commands go to
+        the executor as one batch (see helpers.check_calls).
 
         """
 
+        commands = []
+
         for interface, ips in configuration["ips"].iteritems():
             for ip in ips: # pylint: disable=C0103
                 logger.info("Calling: %s addr add %s dev %s", self._ip_path, ip[0], interface) # pylint: disable=C0301
-                command = [ self._ip_path, "address", "add", ip[0], "dev", interface ] # pylint: disable=C0301
-                try:
-                    subprocess.check_call(command)
-                except subprocess.CalledProcessError as error:
-                    if error.returncode != 2: # TODO Verify this exit code means already present. # pylint: disable=C0301
-                        raise
+                commands.append([ self._ip_path, "address", "add", ip[0], "dev", interface ]) # pylint: disable=C0301
 
         for interface, routes in configuration["routes"].iteritems():
             for route in routes:
                 logger.info("Calling: %s route add to %s via %s dev %s", self._ip_path, route[0], route[1], interface) # pylint: disable=C0301
-                command = [ self._ip_path, "route", "add", "to", route[0], "via", route[1], "dev", interface ] # pylint: disable=C0301
-                try:
-                    subprocess.check_call(command)
-                except subprocess.CalledProcessError as error:
-                    if error.returncode != 2: # TODO Verify this exit code means already present. # pylint: disable=C0301
-                        raise
+                commands.append([ self._ip_path, "route", "add", "to", route[0], "via", route[1], "dev", interface ]) # pylint: disable=C0301
+
+        helpers.check_calls(commands, ignore = ( 2, )) # TODO Verify this exit code means already present. # pylint: disable=C0301
 
         return { "": "" }
 
@@ -5,14 +5,18 @@
 
 import logging
 import os
-import subprocess
 import tempfile
 
+from singularity import helpers
 from singularity.configurators import SingularityConfigurator
 
 logger = logging.getLogger(__name__) # pylint: disable=C0103
 
 class PasswordConfigurator(SingularityConfigurator):
+    @property
+    def message_keys(self): # pylint: disable=R0201,C0111
+        return ( "password", )
+
     def runnable(self, configuration):
         """True if configurator can run on this system and in this context.
 
@@ -38,12 +42,7 @@ class PasswordConfigurator(SingularityConfigurator):
             logger.info("This command must be run as uid 0!")
             return False
 
-        self._chpasswd_path = None # pylint: disable=W0201
-
-        try:
-            self._chpasswd_path = subprocess.check_output("which chpasswd", shell = True).strip() # pylint: disable=C0301,W0201,E1103
-        except subprocess.CalledProcessError:
-            pass
+        self._chpasswd_path = helpers.which("chpasswd") # pylint: disable=W0201
 
         logger.debug("chpasswd path: %s", self._chpasswd_path)
 
@@ -78,7 +77,7 @@ class PasswordConfigurator(SingularityConfigurator):
 
         command = [ self._chpasswd_path ] 
 
-        subprocess.check_call(command, stdin = password)
+        helpers.check_call(command, stdin = password)
 
         return { "": "" }
 
@@ -12,6 +12,10 @@ from singularity.configurators import SingularityConfigurator
 logger = logging.getLogger(__name__) # pylint: disable=C0103
 
 class VersionConfigurator(SingularityConfigurator):
+    @property
+    def message_functions(self): # pylint: disable=R0201,C0111
+        return ( "version", )
+
     def runnable(self, configuration):
         """True if configurator can run on this system and in this context.
 
@@ -0,0 +1,159 @@
+# Copyright (C) 2012 by Alex Brandt <alunduil@alunduil.com>
+#
+# singularity is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Control socket for managing a running daemon.
+
+### Description
+
+The daemon answers commands on daemon.run/control.sock from a background
+thread.  A client sends one line (a command name or a JSON object with the
+command under "command") and gets one line of JSON back:
+
+    C: status
+    S: {"pid": 1234, "pipeline": {"pending": [], "running": [...]}, ...}
+
+    C: {"command": "reload"}
+    S: {"reload": "scheduled"}
+
+Commands are registered by the daemon (see SingularityDaemon._serve_control);
+an unknown command gets {"error": ...}.  singularity daemon status, reload and
+drain use this socket when a daemon is listening on it.
+
+### Examples
+
+>>> socat - UNIX-CONNECT:/var/run/singularity/control.sock
+
+"""
+
+import logging
+import json
+import os
+import socket
+import SocketServer
+import threading
+
+logger = logging.getLogger("console") # pylint: disable=C0103
+
+TIMEOUT = 5.0
+
+_LOCK = threading.Lock()
+_COMMANDS = {}
+
+def register(name, callback):
+    """Register callback (called without arguments) as the command name.
+
+    ### Description
+
+    The callback must return something JSON serializable.  Registering a
+    command again replaces the callback.
+
+    """
+
+    with _LOCK:
+        _COMMANDS[name] = callback
+
+def commands():
+    """Names of the registered commands."""
+
+    with _LOCK:
+        return sorted(_COMMANDS)
+
+def execute(name):
+    """Run the command name and return its result (or an error)."""
+
+    with _LOCK:
+        callback = _COMMANDS.get(name)
+
+    if callback is None:
+        return { "error": "unknown command, {0}; known commands: {1}".format(name, ", ".join(commands())), } # pylint: disable=C0301
+
+    try:
+        return callback()
+    except Exception as error: # pylint: disable=W0703
+        logger.exception(error)
+        return { "error": str(error), }
+
+class ControlHandler(SocketServer.StreamRequestHandler):
+    """Answers the command on each connection with a line of JSON."""
+
+    timeout = TIMEOUT
+
+    def handle(self):
+        try:
+            line = self.rfile.readline().strip()
+        except socket.timeout:
+            return
+
+        name = line
+
+        if line.startswith("{"):
+            try:
+                name = json.loads(line).get("command")
+            except ValueError as error:
+                self.wfile.write(json.dumps({ "error": str(error), }) + "\n")
+                return
+
+        logger.info("Control command, %s", name)
+
+        self.wfile.write(json.dumps(execute(name), default = repr) + "\n")
+
+class ControlServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer): # pylint: disable=R0904
+    daemon_threads = True
+
+def serve(path):
+    """Answer commands on the unix socket at path from a daemon thread."""
+
+    if os.access(path, os.W_OK):
+        os.remove(path)
+
+    logger.info("Accepting control commands on %s", path)
+
+    umask = os.umask(0o177) # Commands like drain are for the administrator.
+
+    try:
+        server = ControlServer(path, ControlHandler)
+    finally:
+        os.umask(umask)
+
+    thread = threading.Thread(target = server.serve_forever, name = "singularity-control") # pylint: disable=C0301
+    thread.daemon = True
+    thread.start()
+
+    return server
+
+def request(path, name):
+    """Send the command name to the daemon at path and return its answer.
+
+    ### Description
+
+    Returns None if no daemon is listening at path and {"error": ...} if the
+    daemon didn't answer (in time or with JSON).
+
+    """
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.settimeout(TIMEOUT)
+
+    try:
+        connection.connect(path)
+    except socket.error as error:
+        logger.info("No daemon listening at %s: %s", path, error)
+        return None
+
+    try:
+        connection.sendall(json.dumps({ "command": name, }) + "\n")
+
+        response = connection.makefile("r").readline()
+    except socket.error as error: # Including socket.timeout.
+        logger.warning("No reply from daemon at %s: %s", path, error)
+        return { "error": "no reply from daemon", }
+    finally:
+        connection.close()
+
+    try:
+        return json.loads(response)
+    except ValueError:
+        logger.warning("No reply from daemon at %s: %r", path, response)
+        return { "error": "no reply from daemon", }
@@ -6,21 +6,33 @@
 from __future__ import print_function
 
 import logging
-import daemon
 import signal
 import pwd
 import grp
 import os
 import fcntl
+import json
 import sys
+import threading
 import time
 
 import singularity.communicators as communicators
 
+from singularity import control
+from singularity import executor
+from singularity import handoff
+from singularity import helpers
+from singularity import metrics
+from singularity import profiler
+from singularity import tracing
+
+from singularity.cache import SingularityCache
 from singularity.parameters import SingularityParameters
+from singularity.communicators.helpers import listen_fds
 from singularity.configurators import SingularityConfigurators
-from singularity.applicator import SingularityApplicator
-from singularity.cache import SingularityCache
+from singularity.jobs import SingularityJobs
+from singularity.journal import SingularityJournal
+from singularity.pipeline import SingularityPipeline
 
 logger = logging.getLogger("console") # pylint: disable=C0103
 
@@ -32,18 +44,37 @@ class SingularityDaemon(object):
                 "reload": self.reinit,
                 "restart": self.restart,
                 "status": self.status,
+                "drain": self.drain,
                 }
         actions[SingularityParameters()["action"]]()
 
-    def start(self): # pylint: disable=R0201
+    def start(self, takeover = False): # pylint: disable=R0201,R0912,R0915
         """Watch the communication module for system updates to apply.
 
+        ### Arguments
+
+        Argument | Description
+        -------- | -----------
+        takeover | Take the communicator over from the running daemon (see restart).
+
         ### Description
 
         Watches the communication bus (i.e. xenbus for xenU) and updates the
         allowed configuration items or runs the appropriate commands on the
         system.
 
+        Messages are handed to a SingularityPipeline so a slow function (i.e.
+        update) does not hold up the responses to other requests.
+
+        When taking over the daemon doesn't wait for the pidfile to start
+        handling messages; it takes the pidfile (and opens the journal) once
+        the old daemon releases it.
+
+        When started by socket activation (LISTEN_FDS) the SocketCommunicator
+        uses the socket passed by the init system and finding the
+        configurators (which imports all of them), starting the pipeline and
+        the executor is left until the first message arrives.
+
         """
 
         # Summoning deamons is tricky business ... 
@@ -53,19 +84,27 @@ class SingularityDaemon(object):
         # sinners, sinners just like you, sir, there, and the horns shall be on
         # the head, with which he will..."
 
+        import daemon # Only start needs python-daemon (not status, drain, ...).
+
         context = daemon.DaemonContext()
 
         if not os.path.exists(SingularityParameters()["daemon.run"]):
             os.makedirs(SingularityParameters()["daemon.run"])
 
-        context.pidfile = PidFile(SingularityParameters()["daemon.pidfile"])
+        pidfile = PidFile(SingularityParameters()["daemon.pidfile"], wait = takeover) # pylint: disable=C0301
+
+        if not takeover:
+            context.pidfile = pidfile
+
         context.umask = 0o002
         context.uid = pwd.getpwnam(SingularityParameters()["daemon.uid"]).pw_uid
         context.gid = grp.getgrnam(SingularityParameters()["daemon.gid"]).gr_gid
         context.prevent_core = not SingularityParameters()["daemon.coredumps"]
         context.detach_process = not SingularityParameters()["daemon.nodaemonize"] # pylint: disable=C0301
 
-        context.files_preserve = []
+        activated = listen_fds()
+
+        context.files_preserve = list(activated)
         context.files_preserve.extend([ handler.stream for handler in logging.getLogger().handlers if hasattr(handler, "stream") ]) # pylint: disable=C0301
         context.files_preserve.extend([ handler.socket for handler in logging.getLogger().handlers if hasattr(handler, "socket") ]) # pylint: disable=C0301
 
@@ -80,61 +119,347 @@ class SingularityDaemon(object):
             sys.exit(0)
 
         def hup_handler(signum, frame): # pylint: disable=W0613
-            """HUP signal reloads the configuration and configurators."""
-            SingularityParameters().reinit()
-            self._configurators = SingularityConfigurators()
+            """HUP signal schedules a reload for the receive loop."""
+            logger.info("Reload requested.")
+            self._reload = True # pylint: disable=W0201
+
+        def usr1_handler(signum, frame): # pylint: disable=W0613
+            """USR1 signal starts or stops profiling (see profiler)."""
+            thread = threading.Thread(target = profiler.toggle, name = "singularity-profiler-toggle") # pylint: disable=C0301
+            thread.daemon = True
+            thread.start()
 
         context.signal_map = {
                 signal.SIGTERM: term_handler,
                 signal.SIGINT: term_handler,
                 signal.SIGHUP: hup_handler,
+                signal.SIGUSR1: usr1_handler,
                 }
 
+        self._reload = False # pylint: disable=W0201
+        self._receiving = False # pylint: disable=W0201
+        self._retiring = None # pylint: disable=W0201
+        self._started = time.time() # pylint: disable=W0201
+
         logger.info("Starting up.")
         with context:
 
-            self._configurators = SingularityConfigurators() # pylint: disable=W0201,C0301
-            self._communicator = communicators.create() # pylint: disable=W0201
+            inherited = None
+
+            if takeover:
+                inherited = handoff.request(os.path.join(SingularityParameters()["daemon.run"], "handoff.sock")) # pylint: disable=C0301
+
+                if inherited is None: # i.e. a daemon from before handoff.
+                    self.stop()
+            elif len(activated):
+                inherited = ( {}, activated, )
+
+            self._communicator = communicators.create(inherited = inherited) # pylint: disable=W0201,C0301
+
+            self._configurators = None # pylint: disable=W0201
+            self._pipeline = None # pylint: disable=W0201
+
+            # Until the daemon being taken over has exited (and with it the
+            # requests it is still applying) the pipeline only queues.
+            self._held = takeover # pylint: disable=W0201
+            self._prepare_lock = threading.Lock() # pylint: disable=W0201
+
+            if not len(activated):
+                self._prepare()
+
+            tracing.configure()
+
+            if not SingularityParameters()["daemon.nometrics"]:
+                metrics.gauge("singularity_communicator_queue_depth", lambda: self._communicator.depth) # pylint: disable=C0301
+                metrics.gauge("singularity_pipeline_pending", lambda: self._pipeline.pending if self._pipeline is not None else 0) # pylint: disable=C0301
+                metrics.gauge("singularity_executable_cache_hits_total", lambda: helpers.EXECUTABLE_STATISTICS["hits"]) # pylint: disable=C0301
+                metrics.gauge("singularity_executable_cache_misses_total", lambda: helpers.EXECUTABLE_STATISTICS["misses"]) # pylint: disable=C0301
+                metrics.gauge("singularity_resident_memory_bytes", metrics.resident_memory) # pylint: disable=C0301
+
+                self._metrics = metrics.serve(os.path.join(SingularityParameters()["daemon.run"], "metrics.sock")) # pylint: disable=W0201,C0301
+
+            self._journal = None # pylint: disable=W0201
+
+            self._serve_control()
+
+            if takeover:
+                thread = threading.Thread(target = self._take_over, args = (context, pidfile), name = "singularity-takeover") # pylint: disable=C0301
+                thread.daemon = True
+                thread.start()
+            else:
+                self._open_journal()
 
             while True:
                 logger.debug("Open files: %s", [ os.path.realpath(os.path.join(os.path.sep, "proc", "self", "fd", fd)) for fd in os.listdir(os.path.join(os.path.sep, "proc", "self", "fd")) ]) # pylint: disable=C0301
 
+                if self._reload:
+                    self._reinit()
+
+                trace = tracing.start()
+
+                self._receiving = True # pylint: disable=W0201
                 identifier, message = self._communicator.receive()
-                logger.info("Got message, %s, with identifier, %s", message, identifier) # pylint: disable=C0301
+                self._receiving = False # pylint: disable=W0201
 
-                functions = set()
-                response = ""
+                logger.info("Got message, %s, with identifier, %s, and trace, %s", message, identifier, trace.identifier) # pylint: disable=C0301
 
-                # TODO Add proper error handling here ...
+                self._prepare()
 
-                logger.debug("Length of configurators: %s", len(self._configurators)) # pylint: disable=C0301
+                # A HUP received while waiting applies to this message.
+                if self._reload:
+                    self._reinit()
 
-                for configurator in self._configurators:
-                    if configurator.function not in [ func.strip() for func in SingularityParameters()["main.functions"].split(",") ]: # pylint: disable=C0301
-                        logger.info("Configurator, %s, is not allowed.", configurator) # pylint: disable=C0301
-                        continue
+                journal = self._journal
 
-                    if not configurator.runnable(message):
-                        logger.info("Configurator, %s, is not runnable.", configurator) # pylint: disable=C0301
+                if journal is not None:
+                    if identifier in journal: # Journaled by a daemon that died before removing it. # pylint: disable=C0301
+                        logger.info("Message, %s, is already being handled from the journal", identifier) # pylint: disable=C0301
+                        self._communicator.accepted(identifier)
                         continue
 
-                    logger.info("Found configurator, %s, with function, %s", configurator, configurator.function) # pylint: disable=C0301
-                    functions.add(configurator.function)
+                    journal.accept(identifier, message)
+
+                self._communicator.accepted(identifier)
 
-                    for filename, content in configurator.content(message).iteritems(): # pylint: disable=C0301
-                        if "message" == filename:
-                            response += content + "\n"
-                        elif filename.startswith("/"):
-                            SingularityCache()[configurator.function + "." + filename] = content # pylint: disable=C0301
+                self._pipeline.submit(identifier, message, trace)
+           
+    def _prepare(self):
+        """Find the configurators and start the executor and the pipeline.
 
-                logger.info("Applying the functions found ...")
-                logger.debug("Functions found: %s", functions)
-                SingularityApplicator()(actions = functions)
+        ### Description
 
-                response = "" + "\n" + response
+        Does nothing once the pipeline is running.  Deferred to the first
+        message when socket activated.  The pipeline is held while taking over
+        (see _take_over).
+
+        """
+
+        with self._prepare_lock:
+            if self._pipeline is not None:
+                return
+
+            start = time.time()
+
+            self._configurators = SingularityConfigurators() # pylint: disable=W0201,C0301
+
+            if not SingularityParameters()["daemon.noexecutor"]:
+                executor.start()
+
+            self._pipeline = SingularityPipeline(self._communicator, self._configurators, held = self._held) # pylint: disable=W0201,C0301
+
+        logger.info("Found %s configurators and started the pipeline in %.3f seconds", len(self._configurators), time.time() - start) # pylint: disable=C0301
+
+    def _open_journal(self):
+        """Open the journal, handle what it holds and serve handoff requests.
+
+        ### Description
+
+        Only one daemon may write the journal so a daemon taking over opens it
+        once it holds the pidfile.  Messages it received before then are not
+        journaled.
+
+        """
+
+        run = SingularityParameters()["daemon.run"]
+
+        if self._communicator.durable and not SingularityParameters()["daemon.nojournal"]: # pylint: disable=C0301
+            journal = SingularityJournal(os.path.join(run, "journal"))
+
+            self._prepare()
+
+            self._pipeline.journal = journal
+            self._journal = journal # pylint: disable=W0201
+
+            for identifier, message in journal.pending:
+                logger.info("Handling unanswered message, %s, with identifier, %s, from the journal", message, identifier) # pylint: disable=C0301
+                self._pipeline.submit(identifier, message, tracing.start())
+
+        handoff.serve(os.path.join(run, "handoff.sock"), self._hand_off)
+
+    def _take_over(self, context, pidfile):
+        """Wait for the old daemon to release the pidfile and take it.
+
+        ### Description
+
+        The old daemon releases the pidfile once it has answered everything it
+        received so only then does the pipeline start applying what this
+        daemon has received meanwhile; two daemons never apply at once.
+
+        """
+
+        logger.info("Waiting for the pidfile, %s", pidfile.path)
+
+        pidfile.__enter__()
+        context.pidfile = pidfile
+
+        logger.info("Took over the pidfile, %s", pidfile.path)
+
+        with self._prepare_lock:
+            self._held = False # pylint: disable=W0201
+
+            if self._pipeline is not None:
+                self._pipeline.release()
+
+        self._open_journal()
+
+    def _hand_off(self):
+        """Give the communicator to a new daemon and exit once idle.
+
+        ### Description
+
+        Called by the handoff thread when a new daemon asks to take over.  No
+        more messages are received; once everything received has been answered
+        (including jobs) and the receive loop is waiting the daemon stops
+        itself as if sent SIGTERM which releases the pidfile to the new daemon.
+
+        Jobs still running in the old daemon are unknown to the new one; a job
+        message for them is answered with the state unknown.
+
+        """
+
+        logger.info("Handing the communicator off to a new daemon.")
+
+        state, fds = self._communicator.handoff()
+
+        self._retire("handoff")
+
+        return state, fds
+
+    def _drain(self):
+        """Answer what has been received and stop (the drain command)."""
+
+        logger.info("Draining.")
+
+        self._communicator.pause()
+
+        self._retire("drain")
+
+        return { "drain": "started", "pending": self._status()["queue"], }
+
+    def _retire(self, reason):
+        """Stop the daemon once everything received has been answered.
+
+        ### Description
+
+        Starts a thread that waits until the communicator has nothing queued,
+        the pipeline is idle, no job is running and the receive loop is
+        waiting and then sends SIGTERM to the daemon.  Only the first call
+        starts the thread.
+
+        """
+
+        if self._retiring is not None:
+            return
+
+        self._retiring = reason # pylint: disable=W0201
+
+        def retire():
+            """Stop once the last response has been sent."""
+            while not (self._receiving and not self._communicator.depth and (self._pipeline is None or self._pipeline.idle) and not len(SingularityJobs())): # pylint: disable=C0301
+                time.sleep(0.1)
+
+            logger.info("Finished %s; stopping.", reason)
+            os.kill(os.getpid(), signal.SIGTERM)
+
+        thread = threading.Thread(target = retire, name = "singularity-retire") # pylint: disable=C0301
+        thread.daemon = True
+        thread.start()
+
+    def _serve_control(self):
+        """Register the control commands and serve them on control.sock."""
+
+        def reload_():
+            """Schedule a reload (as SIGHUP does)."""
+            self._reload = True # pylint: disable=W0201
+            return { "reload": "scheduled", }
+
+        control.register("status", self._status)
+        control.register("reload", reload_)
+        control.register("drain", self._drain)
+        control.register("profile", profiler.toggle)
+        control.register("queue", lambda: self._status()["queue"])
+        control.register("inflight", lambda: self._status()["inflight"])
+        control.register("configurators", self._describe_configurators)
+        control.register("cache", lambda: SingularityCache().statistics)
+        control.register("timings", lambda: self._pipeline.timings() if self._pipeline is not None else {}) # pylint: disable=C0301
+
+        self._control = control.serve(os.path.join(SingularityParameters()["daemon.run"], "control.sock")) # pylint: disable=W0201,C0301
+
+    def _status(self):
+        """The daemon's state for the status control command."""
+
+        requests = { "pending": [], "running": [], }
+
+        if self._pipeline is not None:
+            requests = self._pipeline.requests
+
+        jobs = SingularityJobs().statuses
+
+        return {
+                "pid": os.getpid(),
+                "started": self._started,
+                "uptime": time.time() - self._started,
+                "state": "stopping after " + self._retiring if self._retiring is not None else "running", # pylint: disable=C0301
+                "reload_scheduled": self._reload,
+                "communicator": {
+                    "type": self._communicator.__class__.__name__,
+                    "depth": self._communicator.depth,
+                    },
+                "queue": requests["pending"],
+                "inflight": requests["running"] + [ job for job in jobs if job["finished"] is None ], # pylint: disable=C0301
+                "jobs": jobs,
+                "configurators": self._describe_configurators(),
+                "cache": SingularityCache().statistics,
+                "timings": self._pipeline.timings() if self._pipeline is not None else {}, # pylint: disable=C0301
+                "executor": executor.running(),
+                "profiling": profiler.mode(),
+                "journal": self._journal.path if self._journal is not None else None, # pylint: disable=C0301
+                }
+
+    def _describe_configurators(self):
+        """The loaded configurators (for the configurators control command)."""
+
+        if self._configurators is None:
+            return []
+
+        return [ {
+            "name": configurator.__class__.__name__,
+            "module": configurator.__class__.__module__,
+            "function": configurator.function,
+            "message_functions": configurator.message_functions,
+            "message_keys": configurator.message_keys,
+            "long_running": configurator.long_running,
+            } for configurator in self._configurators ]
+
+    def _reinit(self):
+        """Reload the configuration and any configurators that changed.
+
+        ### Description
+
+        Runs in the receive loop rather than the HUP handler so the imports
+        and file reads of a reload never interrupt the daemon part way
+        through something else.  Only configurator modules whose source
+        changed (or that were added or removed) are imported again.
+
+        """
+
+        self._reload = False # pylint: disable=W0201
+
+        logger.info("Reloading.")
+
+        SingularityParameters().reinit()
+        helpers.clear_executables()
+        tracing.configure()
+
+        if self._pipeline is None: # Nothing found yet; see _prepare.
+            return
+
+        changed = self._configurators.reload()
+
+        logger.info("Configurator modules reloaded: %s", sorted(changed))
+
+        self._pipeline.reinit(self._configurators)
 
-                self._communicator.send(identifier, response.strip())
-           
     def stop(self):
         """Stop any running daemons.
         
@@ -155,12 +480,20 @@ class SingularityDaemon(object):
 
         ### Description
 
-        Sends a SIGHUP to any daemon that is currently running.  If no daemon
-        is running it starts the daemon.
+        Asks the running daemon to reload through its control socket (or
+        sends it a SIGHUP if it doesn't have one).  If no daemon is running it
+        starts the daemon.
 
         """
 
-        if self.running:
+        response = self._control("reload")
+
+        if response is not None and "error" in response:
+            logger.error("Daemon reload failed: %s", response["error"])
+            print(json.dumps(response, indent = 2, sort_keys = True))
+        elif response is not None:
+            logger.info("Daemon reload scheduled.")
+        elif self.running:
             logger.info("Sending daemon, %s, SIGHUP.", self.daemon_pid)
             os.kill(self.daemon_pid, signal.SIGHUP)
         else:
@@ -175,8 +508,17 @@ class SingularityDaemon(object):
         Stops the daemon and then waits for it to actually stop running before
         starting the daemon again.
 
+        With daemon.handoff the new daemon is started straight away and takes
+        over from the running one (see singularity.handoff) so no message
+        waits on the restart.
+
         """
 
+        if SingularityParameters()["daemon.handoff"] and self.running:
+            logger.info("Handing daemon, %s, off to a new daemon.", self.daemon_pid) # pylint: disable=C0301
+            self.start(takeover = True)
+            return
+
         self.stop()
 
         while self.running:
@@ -184,9 +526,50 @@ class SingularityDaemon(object):
 
         self.start()
 
+    def drain(self): # pylint: disable=R0201
+        """Stop the daemon once it has answered what it received.
+
+        ### Description
+
+        The daemon stops taking new messages (requests stay with the
+        hypervisor for the next daemon), finishes the messages and jobs it
+        has and exits.
+
+        """
+
+        response = self._control("drain")
+
+        if response is None:
+            logger.warning("Daemon not running.")
+            print("Singularity is not running ...", file = sys.stderr)
+        else:
+            print(json.dumps(response, indent = 2, sort_keys = True))
+
     def status(self):
-        """Reports the pid of a running daemon."""
-        logger.info("Singularity is running at %s", self.daemon_pid)
+        """Reports the state of a running daemon.
+
+        ### Description
+
+        Prints the daemon's state (see the status control command) as JSON.
+        A daemon without a control socket only has its pid reported.
+
+        """
+
+        response = self._control("status")
+
+        if response is not None:
+            print(json.dumps(response, indent = 2, sort_keys = True))
+        elif self.running:
+            logger.info("Singularity is running at %s", self.daemon_pid)
+            print(json.dumps({ "pid": self.daemon_pid, }, indent = 2))
+        else:
+            logger.warning("Daemon not running.")
+            print("Singularity is not running ...", file = sys.stderr)
+
+    def _control(self, name): # pylint: disable=R0201
+        """Send a command to the running daemon's control socket."""
+
+        return control.request(os.path.join(SingularityParameters()["daemon.run"], "control.sock"), name) # pylint: disable=C0301
 
     @property
     def daemon_pid(self): # pylint: disable=R0201
@@ -218,17 +601,31 @@ class PidFile(object): # pylint: disable=R0903
 
     """
 
-    def __init__(self, path):
+    def __init__(self, path, wait = False):
+        """A pidfile at path; with wait __enter__ waits for the lock."""
+
         self.path = path
+        self.wait = wait
         self.pidfile = None
 
     def __enter__(self):
-        self.pidfile = open(self.path, "a+")
+        while True:
+            self.pidfile = open(self.path, "a+")
+
+            try:
+                fcntl.flock(self.pidfile.fileno(), fcntl.LOCK_EX | (0 if self.wait else fcntl.LOCK_NB)) # pylint: disable=C0301
+            except IOError:
+                raise SystemExit("Found an existing pidfile, %s, exiting.", self.path) # TODO Change this up a bit? # pylint: disable=C0301
+
+            # The holder removes the file before unlocking it; the lock we got
+            # after waiting may be on a file that is gone.
+            try:
+                if os.fstat(self.pidfile.fileno()).st_ino == os.stat(self.path).st_ino: # pylint: disable=C0301
+                    break
+            except OSError:
+                pass
 
-        try:
-            fcntl.flock(self.pidfile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
-        except IOError:
-            raise SystemExit("Found an existing pidfile, %s, exiting.", self.path) # TODO Change this up a bit? # pylint: disable=C0301
+            self.pidfile.close()
 
         self.pidfile.seek(0)
         self.pidfile.truncate()
@@ -239,10 +636,10 @@ class PidFile(object): # pylint: disable=R0903
         return self.pidfile
 
     def __exit__(self, exc_type = None, exc_value = None, exc_tb = None):
+        os.remove(self.path) # While locked so a waiting daemon sees it go.
         try:
             self.pidfile.close()
         except IOError as error:
             if error.errno != 9:
                 raise
-        os.remove(self.path)
 
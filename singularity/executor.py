@@ -0,0 +1,292 @@
+# Copyright (C) 2012 by Alex Brandt <alunduil@alunduil.com>
+#
+# singularity is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Long lived helper process that runs the commands of configurators.
+
+### Description
+
+Forking the daemon for every ip, hostname, chpasswd or emerge copies a large
+Python process; a resetnetwork with many addresses and routes does that
+dozens of times.  The daemon instead starts this module once (python -m
+singularity.executor) which imports nothing but the standard library and
+forks itself (a small process) for each command.
+
+The daemon writes requests to the executor's stdin and reads responses from
+its stdout, one JSON object per line.  A request is a batch of commands run
+one after the other (stopping at the first failure, a returncode not listed
+in ignore, if stop is set) with an optional deadline for the whole batch:
+
+{"id": 3, "commands": [{"command": ["/bin/ip", "address", "add", ...], "stdin": null}], "timeout": 600, "stop": true, "ignore": [2]}
+
+{"id": 3, "results": [{"returncode": 0, "output": ""}], "killed": false}
+
+Batches run on their own threads so a long emerge doesn't hold up an ip.  If
+the deadline passes the running command's process group is killed and killed
+is set.  Only the last OUTPUT_LIMIT bytes of a command's output are kept (an
+emerge writes megabytes).  The executor exits when its stdin is closed (the
+daemon went away).
+
+helpers.check_call (one command) and helpers.check_calls (a batch) send their
+commands here once start has been called and run them themselves if the
+executor isn't running.
+
+"""
+
+import logging
+import itertools
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+logger = logging.getLogger("console") # pylint: disable=C0103
+
+class ExecutorUnavailable(Exception):
+    """Raised when there is no executor process to send a batch to."""
+    pass
+
+GRACE = 5.0 # Seconds past a batch's deadline to wait for the executor's reply.
+OUTPUT_LIMIT = 64 * 1024 # Bytes of each command's output kept (the tail).
+
+_PROCESS = None
+_PENDING = {}
+_LOCK = threading.Lock()
+_IDENTIFIERS = itertools.count()
+
+def start():
+    """Start the executor process and the thread reading its responses."""
+
+    global _PROCESS # pylint: disable=W0603
+
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join([ os.path.dirname(os.path.dirname(os.path.abspath(__file__))) ] + [ path for path in environment.get("PYTHONPATH", "").split(os.pathsep) if len(path) ]) # pylint: disable=C0301
+
+    process = subprocess.Popen([ sys.executable, "-m", "singularity.executor" ], stdin = subprocess.PIPE, stdout = subprocess.PIPE, close_fds = True, env = environment) # pylint: disable=C0301
+
+    logger.info("Started executor with pid, %s", process.pid)
+
+    with _LOCK:
+        _PROCESS = process
+
+    thread = threading.Thread(target = _read, args = (process,), name = "singularity-executor") # pylint: disable=C0301
+    thread.daemon = True
+    thread.start()
+
+def stop():
+    """Close the executor's stdin (it exits once its batches finish)."""
+
+    global _PROCESS # pylint: disable=W0603
+
+    with _LOCK:
+        process, _PROCESS = _PROCESS, None
+
+    if process is not None:
+        process.stdin.close()
+
+def running():
+    """True if there is an executor to send batches to."""
+
+    return _PROCESS is not None
+
+def run(commands, timeout = None, stop = False, ignore = ()): # pylint: disable=W0621
+    """Run a batch of commands in the executor and wait for the results.
+
+    ### Arguments
+
+    Argument | Description
+    -------- | -----------
+    commands | List of (command, stdin) with command an argument list and stdin a string or None.
+    timeout  | Seconds the whole batch may take (None for no limit).
+    stop     | Don't run the rest of the batch once a command fails.
+    ignore   | Returncodes that don't count as failing for stop.
+
+    ### Description
+
+    Returns the list of results ({"returncode": ..., "output": ...}) of the
+    commands that ran and whether the batch was killed by its deadline.
+    Raises ExecutorUnavailable if the executor isn't running (before anything
+    was sent) and OSError if it went away while the batch was running.
+
+    If the executor hasn't replied GRACE seconds after the deadline (it hung)
+    the batch is given up on and reported as killed with no results.
+
+    """
+
+    identifier = next(_IDENTIFIERS)
+    event = threading.Event()
+
+    request = json.dumps({
+        "id": identifier,
+        "commands": [ { "command": command, "stdin": stdin, } for command, stdin in commands ], # pylint: disable=C0301
+        "timeout": timeout,
+        "stop": stop,
+        "ignore": list(ignore),
+        })
+
+    with _LOCK:
+        if _PROCESS is None:
+            raise ExecutorUnavailable("executor is not running")
+
+        _PENDING[identifier] = [ event, None ]
+
+        try:
+            _PROCESS.stdin.write(request + "\n")
+            _PROCESS.stdin.flush()
+        except (IOError, ValueError):
+            del _PENDING[identifier]
+            raise ExecutorUnavailable("executor is not accepting commands")
+
+    if not event.wait(timeout + GRACE if timeout is not None else None):
+        with _LOCK:
+            _PENDING.pop(identifier, None)
+
+        logger.error("Executor did not answer batch, %s, within %s seconds", identifier, timeout + GRACE) # pylint: disable=C0301
+
+        return [], True
+
+    with _LOCK:
+        response = _PENDING.pop(identifier)[1]
+
+    if response is None:
+        raise OSError("executor exited while running {0}".format(commands))
+
+    return response["results"], response["killed"]
+
+def _read(process):
+    """Hand the executor's responses to the threads waiting for them."""
+
+    global _PROCESS # pylint: disable=W0603
+
+    for line in iter(process.stdout.readline, ""):
+        response = json.loads(line)
+
+        with _LOCK:
+            if response["id"] in _PENDING:
+                _PENDING[response["id"]][1] = response
+                _PENDING[response["id"]][0].set()
+
+    logger.warning("Executor, %s, exited with %s", process.pid, process.wait())
+
+    with _LOCK:
+        if _PROCESS is process:
+            _PROCESS = None
+
+        for event, response in _PENDING.itervalues(): # pylint: disable=W0612
+            event.set()
+
+def serve(requests = sys.stdin, responses = sys.stdout):
+    """The executor's side: run the batches read from requests."""
+
+    lock = threading.Lock()
+
+    for line in iter(requests.readline, ""):
+        thread = threading.Thread(target = _batch, args = (json.loads(line), responses, lock)) # pylint: disable=C0301
+        thread.daemon = True
+        thread.start()
+
+def _batch(request, responses, lock):
+    results = []
+    killed = []
+
+    expires = None
+    if request.get("timeout"):
+        expires = time.time() + request["timeout"]
+
+    for item in request["commands"]:
+        if expires is not None and expires <= time.time():
+            killed.append(True)
+            break
+
+        command = [ argument.encode("utf-8") for argument in item["command"] ]
+        stdin = item.get("stdin")
+
+        if stdin is not None:
+            stdin = stdin.encode("utf-8")
+
+        try:
+            process = subprocess.Popen(command, stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = subprocess.STDOUT, preexec_fn = os.setsid) # pylint: disable=C0301
+        except OSError as error:
+            results.append({ "returncode": 127, "output": str(error), })
+            if request.get("stop"):
+                break
+            continue
+
+        timer = None
+
+        if expires is not None:
+            def kill(process = process):
+                """Kill the command's process group once the deadline passes."""
+                killed.append(True)
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+
+            timer = threading.Timer(expires - time.time(), kill)
+            timer.daemon = True
+            timer.start()
+
+        try:
+            output = _output(process, stdin)
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+        results.append({ "returncode": process.returncode, "output": output.decode("utf-8", "replace"), }) # pylint: disable=C0301
+
+        if len(killed) or (process.returncode and process.returncode not in request.get("ignore", []) and request.get("stop")): # pylint: disable=C0301
+            break
+
+    response = json.dumps({ "id": request["id"], "results": results, "killed": bool(len(killed)), }) # pylint: disable=C0301
+
+    with lock:
+        responses.write(response + "\n")
+        responses.flush()
+
+def _output(process, stdin):
+    """Feed stdin to process, wait for it and return the tail of its output."""
+
+    if stdin is not None:
+        def feed():
+            """Write stdin from a thread so a chatty command can't block us."""
+            try:
+                process.stdin.write(stdin)
+            except IOError:
+                pass
+            finally:
+                process.stdin.close()
+
+        writer = threading.Thread(target = feed)
+        writer.daemon = True
+        writer.start()
+    else:
+        process.stdin.close()
+
+    output = ""
+    truncated = False
+
+    for chunk in iter(lambda: os.read(process.stdout.fileno(), 65536), ""):
+        output += chunk
+
+        if len(output) > OUTPUT_LIMIT:
+            output = output[-OUTPUT_LIMIT:]
+            truncated = True
+
+    process.stdout.close()
+    process.wait()
+
+    if truncated:
+        output = "[output truncated to the last {0} bytes]\n".format(OUTPUT_LIMIT) + output # pylint: disable=C0301
+
+    return output
+
+if __name__ == "__main__":
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # The daemon decides when we go.
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    serve()
@@ -0,0 +1,124 @@
+# Copyright (C) 2012 by Alex Brandt <alunduil@alunduil.com>
+#
+# singularity is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Hand the daemon's communicator over to its replacement.
+
+### Description
+
+singularity daemon restart --handoff starts the new daemon without waiting for
+the old one to stop.  The new daemon connects to daemon.run/handoff.sock of
+the old one which stops taking messages from the hypervisor and replies with
+a line of JSON describing the state of its communicator (see
+Communicator.handoff; i.e. the messages XenCommunicator had queued) followed
+by the file descriptors it holds (i.e. SocketCommunicator's listening socket)
+passed with SCM_RIGHTS:
+
+{"pid": 1234, "communicator": {"queue": [...]}, "fds": 1}
+
+The new daemon builds its communicator from that and starts receiving
+messages straight away while the old one finishes the requests it already
+had and exits.  The new daemon only takes the pidfile over (and starts
+applying what it received meanwhile) once the old one has released it.
+
+"""
+
+import logging
+import json
+import os
+import socket
+import threading
+
+from _multiprocessing import sendfd, recvfd # pylint: disable=E0611
+
+logger = logging.getLogger("console") # pylint: disable=C0103
+
+def serve(path, callback):
+    """Answer handoff requests on the unix socket at path from a thread.
+
+    ### Arguments
+
+    Argument | Description
+    -------- | -----------
+    path     | The path of the socket to listen on.
+    callback | Called (without arguments) for a request; returns (state, fds).
+
+    """
+
+    if os.access(path, os.W_OK):
+        os.remove(path)
+
+    logger.info("Accepting handoff requests on %s", path)
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    umask = os.umask(0o177) # A connection retires the daemon and takes its socket. # pylint: disable=C0301
+
+    try:
+        listener.bind(path)
+    finally:
+        os.umask(umask)
+
+    listener.listen(1)
+
+    def accept():
+        while True:
+            connection, address = listener.accept() # pylint: disable=W0612
+
+            try:
+                state, fds = callback()
+
+                connection.sendall(json.dumps({ "pid": os.getpid(), "communicator": state, "fds": len(fds), }) + "\n") # pylint: disable=C0301
+
+                for fd in fds: # pylint: disable=C0103
+                    sendfd(connection.fileno(), fd)
+            except Exception as error: # pylint: disable=W0703
+                logger.exception(error)
+            finally:
+                connection.close()
+
+    thread = threading.Thread(target = accept, name = "singularity-handoff")
+    thread.daemon = True
+    thread.start()
+
+    return listener
+
+def request(path):
+    """Ask the daemon listening at path to hand over its communicator.
+
+    ### Description
+
+    Returns the state and the list of file descriptors sent by the old daemon
+    or None if no daemon is listening at path.
+
+    """
+
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        connection.connect(path)
+    except socket.error as error:
+        logger.info("No daemon to take over from at %s: %s", path, error)
+        return None
+
+    try:
+        line = ""
+        while not line.endswith("\n"): # Unbuffered; recvfd reads what follows.
+            piece = connection.recv(1)
+
+            if not len(piece):
+                logger.warning("Daemon at %s closed the handoff", path)
+                return None
+
+            line += piece
+
+        reply = json.loads(line)
+
+        fds = [ recvfd(connection.fileno()) for index in range(reply["fds"]) ] # pylint: disable=W0612
+    finally:
+        connection.close()
+
+    logger.info("Took over from daemon, %s: %s, %s", reply["pid"], reply["communicator"], fds) # pylint: disable=C0301
+
+    return reply["communicator"], fds
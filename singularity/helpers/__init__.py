@@ -5,6 +5,13 @@
 
 import logging
 import os
+import signal
+import subprocess
+import threading
+import time
+
+from singularity import executor
+from singularity import metrics
 
 logger = logging.getLogger("console") # pylint: disable=C0103
 
@@ -13,3 +20,292 @@ VIRTUAL = "physical"
 if os.access(os.path.join(os.path.sep, "proc", "xen", "capabilities"), os.R_OK):
     VIRTUAL = "xenU"
 
+EXECUTABLE_STATISTICS = { "hits": 0, "misses": 0, }
+
+_LOCAL = threading.local()
+
+_EXECUTABLES = {}
+_EXECUTABLES_LOCK = threading.RLock() # Re-entrant for clear_executables in the SIGHUP handler. # pylint: disable=C0301
+_PATH = None
+
+def which(command):
+    """The full path of command or None if it is not on the PATH.
+
+    ### Arguments
+
+    Argument | Description
+    -------- | -----------
+    command  | The name of the executable to find (i.e. "ip").
+
+    ### Description
+
+    Replaces shelling out to which(1).  The PATH is split once and each
+    resolved command is remembered along with the inode and mtime of the file
+    found.  Later lookups only stat that file and search the PATH again if it
+    has changed or gone away.  Commands that could not be found aren't
+    remembered (they are searched for again until they are installed);
+    clear_executables (called on SIGHUP) forgets everything.
+
+    EXECUTABLE_STATISTICS counts the lookups answered from the cache (hits)
+    and those that searched the PATH (misses).
+
+    ### Examples
+
+    >>> which("ip")
+    '/bin/ip'
+
+    """
+
+    global _PATH # pylint: disable=W0603
+
+    with _EXECUTABLES_LOCK:
+        if command in _EXECUTABLES:
+            path, signature = _EXECUTABLES[command]
+
+            if _signature(path) == signature:
+                EXECUTABLE_STATISTICS["hits"] += 1
+                return path
+
+            logger.info("Executable, %s, changed; searching PATH again", path)
+
+        EXECUTABLE_STATISTICS["misses"] += 1
+
+        if _PATH is None:
+            _PATH = [ directory for directory in os.environ.get("PATH", os.defpath).split(os.pathsep) if len(directory) ] # pylint: disable=C0301
+
+        path = None
+        for directory in _PATH:
+            candidate = os.path.join(directory, command)
+            if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+                path = candidate
+                break
+
+        logger.debug("%s path: %s", command, path)
+
+        if path is not None:
+            _EXECUTABLES[command] = (path, _signature(path))
+        else:
+            _EXECUTABLES.pop(command, None)
+
+        return path
+
+def clear_executables():
+    """Forget all paths resolved by which and re-read the PATH."""
+
+    global _PATH # pylint: disable=W0603
+
+    with _EXECUTABLES_LOCK:
+        _EXECUTABLES.clear()
+        _PATH = None
+
+class DeadlineExceeded(Exception):
+    """Raised when a command is killed because its deadline passed."""
+
+    def __init__(self, command, timeout):
+        super(DeadlineExceeded, self).__init__("Command '{0}' did not finish within {1} seconds".format(" ".join(command), timeout)) # pylint: disable=C0301
+        self.command = command
+        self.timeout = timeout
+
+class deadline(object): # pylint: disable=C0103,R0903
+    """Context manager that bounds the commands run in its body.
+
+    ### Arguments
+
+    Argument | Description
+    -------- | -----------
+    timeout  | Seconds the commands in the body may take in total (0 or None for no limit).
+
+    ### Description
+
+    Applies to check_call in the same thread: each command is started in its
+    own process group and if the deadline passes before it exits the whole
+    group is killed and DeadlineExceeded is raised.  Deadlines nest; the
+    earliest one wins.
+
+    ### Examples
+
+    >>> with deadline(30):
+    ...     check_call([ which("ip"), "route", "flush", "cache" ])
+
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._previous = None
+
+    def __enter__(self):
+        self._previous = getattr(_LOCAL, "deadline", None)
+
+        if self.timeout:
+            expires = (time.time() + self.timeout, self.timeout)
+            if self._previous is None or expires[0] < self._previous[0]:
+                _LOCAL.deadline = expires
+
+        return self
+
+    def __exit__(self, exc_type = None, exc_value = None, exc_tb = None):
+        _LOCAL.deadline = self._previous
+
+def check_call(command, **kwargs):
+    """Run command and raise CalledProcessError if it fails.
+
+    ### Arguments
+
+    Argument | Description
+    -------- | -----------
+    command  | The argument list to run (command[0] is the executable).
+    kwargs   | Passed on to subprocess.Popen (i.e. stdin).
+
+    ### Description
+
+    Configurators run their commands through this function rather than
+    subprocess directly so the daemon can account for them and bound them with
+    a deadline (see deadline).
+
+    Once the daemon has started singularity.executor the command is run by
+    that (small) process instead of forking the daemon.  If the executor is
+    not running (i.e. singularity apply) or kwargs holds anything but stdin
+    the command is run here.
+
+    """
+
+    metrics.increment("singularity_subprocess_spawns_total", command = os.path.basename(command[0])) # pylint: disable=C0301
+
+    expires = getattr(_LOCAL, "deadline", None)
+
+    remaining = None
+
+    if expires is not None:
+        remaining = expires[0] - time.time()
+
+        if remaining <= 0:
+            raise DeadlineExceeded(command, expires[1])
+
+    if executor.running() and set(kwargs.iterkeys()) <= set([ "stdin" ]):
+        stdin = kwargs.get("stdin")
+
+        if hasattr(stdin, "read"):
+            stdin = stdin.read()
+
+        try:
+            results, killed = executor.run([ (command, stdin) ], timeout = remaining) # pylint: disable=C0301
+        except executor.ExecutorUnavailable as error:
+            logger.warning("Running %s locally: %s", command, error)
+
+            if hasattr(kwargs.get("stdin"), "seek"):
+                kwargs["stdin"].seek(0)
+        else:
+            if killed:
+                raise DeadlineExceeded(command, expires[1])
+
+            logger.debug("Output of %s: %s", command, results[0]["output"])
+
+            if results[0]["returncode"]:
+                raise subprocess.CalledProcessError(results[0]["returncode"], command, results[0]["output"]) # pylint: disable=C0301
+
+            return 0
+
+    if expires is None:
+        return subprocess.check_call(command, **kwargs)
+
+    process = subprocess.Popen(command, preexec_fn = os.setsid, **kwargs)
+
+    killed = []
+
+    def kill():
+        """Kill the command's process group once the deadline passes."""
+        logger.warning("Killing %s; deadline of %s seconds passed", command, expires[1]) # pylint: disable=C0301
+        killed.append(True)
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    timer = threading.Timer(remaining, kill)
+    timer.daemon = True
+    timer.start()
+
+    try:
+        returncode = process.wait()
+    finally:
+        timer.cancel()
+
+    if len(killed):
+        raise DeadlineExceeded(command, expires[1])
+
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, command)
+
+    return returncode
+
+def check_calls(commands, ignore = ()):
+    """Run commands one after the other; stop at and raise for a failure.
+
+    ### Arguments
+
+    Argument | Description
+    -------- | -----------
+    commands | The argument lists to run in order.
+    ignore   | Returncodes that don't count as failing (i.e. already present).
+
+    ### Description
+
+    With the executor running the commands go to it as one batch (one round
+    trip however many there are; see singularity.executor) bounded by the
+    current deadline.  Otherwise they are run one by one with check_call.
+    Raises CalledProcessError for the first command that fails (the rest
+    aren't run) and DeadlineExceeded if the deadline passes.
+
+    """
+
+    if not len(commands):
+        return 0
+
+    expires = getattr(_LOCAL, "deadline", None)
+
+    remaining = None
+
+    if expires is not None:
+        remaining = expires[0] - time.time()
+
+        if remaining <= 0:
+            raise DeadlineExceeded(commands[0], expires[1])
+
+    if executor.running():
+        try:
+            results, killed = executor.run([ (command, None) for command in commands ], timeout = remaining, stop = True, ignore = ignore) # pylint: disable=C0301
+        except executor.ExecutorUnavailable as error:
+            logger.warning("Running %s locally: %s", commands, error)
+        else:
+            for command, result in zip(commands, results):
+                metrics.increment("singularity_subprocess_spawns_total", command = os.path.basename(command[0])) # pylint: disable=C0301
+
+                logger.debug("Output of %s: %s", command, result["output"])
+
+            if killed:
+                raise DeadlineExceeded(commands[max(len(results) - 1, 0)], expires[1]) # pylint: disable=C0301
+
+            for command, result in zip(commands, results):
+                if result["returncode"] and result["returncode"] not in ignore:
+                    raise subprocess.CalledProcessError(result["returncode"], command, result["output"]) # pylint: disable=C0301
+
+            return 0
+
+    for command in commands:
+        try:
+            check_call(command)
+        except subprocess.CalledProcessError as error:
+            if error.returncode not in ignore:
+                raise
+
+    return 0
+
+def _signature(path):
+    """The (inode, mtime) of path or None if it can't be stat'ed."""
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return (stat.st_ino, stat.st_mtime)
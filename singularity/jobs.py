@@ -0,0 +1,203 @@
+# Copyright (C) 2012 by Alex Brandt <alunduil@alunduil.com>
+#
+# singularity is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Background jobs for messages handled by long running configurators.
+
+### Description
+
+Messages whose configurators are long running (i.e. update which runs emerge)
+would hold a pipeline worker for minutes.  Instead the pipeline submits the
+work as a job, answers the hypervisor with the job's identifier straight away
+and the job runs on one of daemon.jobs job threads.  The request keeps its
+functions (so the pipeline's [concurrency] limits still apply) and its trace
+until the job finishes.
+
+The hypervisor polls the job with a job message whose value is the
+identifier; JobConfigurator answers with the job's status:
+
+    H: {"name":"agentupdate", "value":"..."}
+    G: {"message":"1357000000-1", "returncode":"0"}
+
+    H: {"name":"job", "value":"1357000000-1"}
+    G: {"message":"{\"state\": \"running\", ...}", "returncode":"0"}
+
+The FINISHED most recently finished jobs are remembered; jobs do not survive
+a restart of the daemon.
+
+"""
+
+import logging
+import itertools
+import Queue
+import threading
+import time
+
+from singularity import metrics
+from singularity import profiler
+from singularity import tracing
+from singularity.parameters import SingularityParameters
+
+logger = logging.getLogger("console") # pylint: disable=C0103
+
+FINISHED = 64
+
+class SingularityJob(object): # pylint: disable=R0903
+    """A unit of background work and its outcome.
+
+    ### Description
+
+    state is one of pending, running, succeeded or failed.  Once finished,
+    message and returncode hold what the hypervisor would have been sent had
+    the work been done before answering.
+
+    """
+
+    def __init__(self, identifier, work, functions, trace = tracing.NULL_TRACE, done = None): # pylint: disable=C0301,R0913
+        self.identifier = identifier
+        self.work = work
+        self.functions = functions
+        self.trace = trace
+        self.done = done
+
+        self.state = "pending"
+        self.message = ""
+        self.returncode = None
+
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def __repr__(self):
+        return "<SingularityJob {0} {1}>".format(self.identifier, self.state)
+
+    @property
+    def status(self):
+        """The job's status as a dictionary (for JobConfigurator)."""
+
+        return {
+                "id": self.identifier,
+                "functions": sorted(self.functions),
+                "state": self.state,
+                "message": self.message,
+                "returncode": self.returncode,
+                "submitted": self.submitted,
+                "started": self.started,
+                "finished": self.finished,
+                }
+
+class SingularityJobs(object): # pylint: disable=R0903
+    # Borg so JobConfigurator sees the jobs the pipeline submitted.
+
+    __shared_state = {}
+
+    def __init__(self):
+        """Start the job threads (daemon.jobs of them) on first use."""
+
+        self.__dict__ = self.__shared_state
+
+        if "_jobs" not in self.__dict__:
+            self._lock = threading.Lock()
+            self._jobs = {}
+            self._finished = []
+            self._queue = Queue.Queue()
+            self._identifiers = itertools.count()
+            self._start = int(time.time())
+
+            for index in range(max(1, int(SingularityParameters()["daemon.jobs"] or 1))): # pylint: disable=C0301
+                thread = threading.Thread(target = self._work, name = "singularity-job-{0}".format(index)) # pylint: disable=C0301
+                thread.daemon = True
+                thread.start()
+
+    def submit(self, work, functions, trace = tracing.NULL_TRACE, done = None): # pylint: disable=C0301
+        """Queue work (a callable returning (message, returncode)).
+
+        ### Arguments
+
+        Argument  | Description
+        --------  | -----------
+        work      | Called without arguments on a job thread.
+        functions | The configurator functions the job runs (for status).
+        trace     | The trace work's spans are recorded on (activated for it).
+        done      | Called with the job on the job thread once it finished.
+
+        ### Description
+
+        Returns the SingularityJob; its identifier is unique for the life of
+        the daemon.
+
+        """
+
+        identifier = "{0}-{1}".format(self._start, next(self._identifiers))
+
+        job = SingularityJob(identifier, work, functions, trace, done)
+
+        with self._lock:
+            self._jobs[identifier] = job
+
+        logger.info("Submitted job, %s", job)
+
+        self._queue.put(job)
+
+        return job
+
+    @property
+    def statuses(self):
+        """Status of every job still remembered (oldest first)."""
+
+        with self._lock:
+            return [ job.status for job in sorted(self._jobs.itervalues(), key = lambda job: job.submitted) ] # pylint: disable=C0301
+
+    def __getitem__(self, identifier):
+        with self._lock:
+            return self._jobs[identifier]
+
+    def __contains__(self, identifier):
+        with self._lock:
+            return identifier in self._jobs
+
+    def __len__(self):
+        with self._lock:
+            return len([ job for job in self._jobs.itervalues() if job.finished is None ]) # pylint: disable=C0301
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+
+            job.state = "running"
+            job.started = time.time()
+
+            logger.info("Running job, %s", job)
+
+            tracing.activate(job.trace)
+
+            try:
+                job.message, job.returncode = profiler.profiled(job.work)
+            except Exception as error: # pylint: disable=W0703
+                logger.exception(error)
+                job.message, job.returncode = str(error), 1
+            finally:
+                tracing.activate(tracing.NULL_TRACE)
+
+            job.state = "succeeded" if job.returncode == 0 else "failed"
+            job.finished = time.time()
+            job.work = None
+
+            logger.info("Finished job, %s", job)
+
+            metrics.increment("singularity_jobs_total", state = job.state)
+
+            with self._lock:
+                self._finished.append(job.identifier)
+
+                while len(self._finished) > FINISHED:
+                    self._jobs.pop(self._finished.pop(0), None)
+
+            done, job.done, job.trace = job.done, None, tracing.NULL_TRACE
+
+            if done is not None:
+                try:
+                    done(job)
+                except Exception as error: # pylint: disable=W0703
+                    logger.exception(error)
@@ -0,0 +1,218 @@
+# Copyright (C) 2012 by Alex Brandt <alunduil@alunduil.com>
+#
+# singularity is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Journal of the messages the daemon has accepted but not yet answered.
+
+### Description
+
+XenCommunicator leaves a request in xenstore until the daemon has accepted
+it (see Communicator.accepted), so a daemon that dies before then finds it
+again.  Once removed, a daemon that dies before answering would lose the
+request and the hypervisor would have to wait out its timeout and retry.
+The daemon therefore appends every message it accepts to daemon.run/journal
+before it is removed and appends a matching record once the response has
+been sent.  Messages without a response are handled again when
+the daemon starts, before anything new is received.
+
+Records are lines of JSON:
+
+{"accept": "1357000000-1", "message": {"function": "resetnetwork", ...}}
+{"done": "1357000000-1"}
+
+Appends are flushed immediately but fsync'd in batches (at most every
+SYNC_INTERVAL seconds) by a background thread so a burst of messages costs
+one fsync rather than one each.  Once every accepted message is answered the
+journal is truncated; while messages are outstanding it is rewritten with
+only those once it holds more than COMPACT_RECORDS answered ones (both are
+synced with the next batch).
+
+Password messages are never written: they carry the decrypted password and
+cannot be decrypted again after a restart anyway (the keys from keyinit are
+gone).
+
+"""
+
+import logging
+import json
+import os
+import threading
+import time
+
+logger = logging.getLogger("console") # pylint: disable=C0103
+
+SYNC_INTERVAL = 0.05
+COMPACT_RECORDS = 1024
+
+SKIPPED_FUNCTIONS = [ "password", ]
+
+class SingularityJournal(object):
+    def __init__(self, path):
+        """Open (or create) the journal at path and read what's outstanding.
+
+        ### Description
+
+        The messages accepted but not answered by a previous daemon are
+        available (in the order they were accepted) from pending until they
+        are marked done.
+
+        """
+
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._dirty = threading.Event()
+
+        self._pending = {}
+        self._order = []
+        self._answered = 0
+
+        if os.access(self.path, os.R_OK):
+            self._read()
+
+        self._file = open(self.path, "a")
+
+        if self._answered:
+            self._compact()
+
+        thread = threading.Thread(target = self._sync, name = "singularity-journal") # pylint: disable=C0301
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def pending(self):
+        """(identifier, message) of every message without a response."""
+
+        with self._lock:
+            return [ (identifier, self._pending[identifier]) for identifier in self._order ] # pylint: disable=C0301
+
+    def __contains__(self, identifier):
+        """True if the message identifier is journaled but not answered."""
+
+        with self._lock:
+            return identifier in self._pending
+
+    def accept(self, identifier, message):
+        """Record that message (received as identifier) is being handled."""
+
+        if message.get("function") in SKIPPED_FUNCTIONS:
+            return
+
+        try:
+            line = json.dumps({ "accept": identifier, "message": message, })
+        except (TypeError, ValueError) as error:
+            logger.warning("Message, %s, not journaled: %s", identifier, error) # pylint: disable=C0301
+            return
+
+        with self._lock:
+            if identifier not in self._pending:
+                self._order.append(identifier)
+
+            self._pending[identifier] = message
+
+            self._write(line)
+
+    def done(self, identifier):
+        """Record that the response for identifier has been sent."""
+
+        with self._lock:
+            if identifier not in self._pending:
+                return
+
+            del self._pending[identifier]
+            self._order.remove(identifier)
+
+            self._write(json.dumps({ "done": identifier, }))
+
+            self._answered += 1
+
+            if not len(self._pending):
+                self._file.truncate(0)
+                self._answered = 0
+                self._dirty.set()
+            elif self._answered > COMPACT_RECORDS:
+                self._compact()
+
+    def _read(self):
+        with open(self.path, "r") as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning("Ignoring torn journal record: %s", line.strip()) # pylint: disable=C0301
+                    continue
+
+                if "accept" in record:
+                    if record["accept"] not in self._pending:
+                        self._order.append(record["accept"])
+                    self._pending[record["accept"]] = _restore(record["message"]) # pylint: disable=C0301
+                elif "done" in record:
+                    self._answered += 1
+                    if record["done"] in self._pending:
+                        del self._pending[record["done"]]
+                        self._order.remove(record["done"])
+
+        logger.info("Journal, %s, has %s unanswered messages", self.path, len(self._order)) # pylint: disable=C0301
+
+    def _write(self, line):
+        self._file.write(line + "\n")
+        self._file.flush()
+        self._dirty.set()
+
+    def _compact(self):
+        """Rewrite the journal with only the unanswered messages.
+
+        ### Description
+
+        Must be called with the lock held.  The new journal is written next to
+        the old one, fsync'd and renamed over it.
+
+        """
+
+        logger.debug("Compacting journal, %s", self.path)
+
+        temporary = self.path + ".new"
+
+        with open(temporary, "w") as journal:
+            for identifier in self._order:
+                journal.write(json.dumps({ "accept": identifier, "message": self._pending[identifier], }) + "\n") # pylint: disable=C0301
+
+            journal.flush()
+            os.fsync(journal.fileno())
+
+        os.rename(temporary, self.path)
+
+        self._file.close()
+        self._file = open(self.path, "a")
+
+        self._answered = 0
+
+    def _sync(self):
+        while True:
+            self._dirty.wait()
+            self._dirty.clear()
+
+            with self._lock: # _compact may replace the file meanwhile.
+                descriptor = os.dup(self._file.fileno())
+
+            try:
+                os.fsync(descriptor)
+            except OSError as error:
+                logger.warning("Journal, %s, not synced: %s", self.path, error) # pylint: disable=C0301
+            finally:
+                os.close(descriptor)
+
+            time.sleep(SYNC_INTERVAL) # Let the next batch fill up.
+
+def _restore(message):
+    """Turn the lists JSON made of the tuples in a message back into tuples."""
+
+    for key in [ "ips", "routes", ]:
+        if isinstance(message.get(key), dict):
+            message[key] = dict([ (interface, [ tuple(item) for item in items ]) for interface, items in message[key].iteritems() ]) # pylint: disable=C0301
+
+    if isinstance(message.get("resolvers"), list):
+        message["resolvers"] = [ tuple(item) for item in message["resolvers"] ]
+
+    return message
@@ -0,0 +1,227 @@
+# Copyright (C) 2012 by Alex Brandt <alunduil@alunduil.com>
+#
+# singularity is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Daemon health metrics in the Prometheus text format.
+
+### Description
+
+Counters and histograms are updated in place by the code doing the work
+(increment and observe) and gauges are read when the metrics are rendered
+(gauge).  The daemon serves the rendered metrics on daemon.run/metrics.sock
+from a background thread so scraping never waits on the receive loop.
+
+### Examples
+
+The socket answers plain connections and HTTP GET requests:
+
+>>> socat - UNIX-CONNECT:/var/run/singularity/metrics.sock
+>>> curl --unix-socket /var/run/singularity/metrics.sock http://localhost/metrics
+
+"""
+
+import logging
+import os
+import socket
+import SocketServer
+import threading
+
+logger = logging.getLogger("console") # pylint: disable=C0103
+
+BUCKETS = ( 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, ) # pylint: disable=C0301
+
+DESCRIPTIONS = {
+        "singularity_requests_total": ( "counter", "Messages received by function.", ), # pylint: disable=C0301
+        "singularity_configurator_seconds": ( "histogram", "Time spent in each configurator by stage.", ), # pylint: disable=C0301
+        "singularity_cache_reads_total": ( "counter", "Files read from the cache.", ), # pylint: disable=C0301
+        "singularity_cache_read_bytes_total": ( "counter", "Bytes read from the cache.", ), # pylint: disable=C0301
+        "singularity_cache_writes_total": ( "counter", "Files written to the cache.", ), # pylint: disable=C0301
+        "singularity_cache_written_bytes_total": ( "counter", "Bytes written to the cache.", ), # pylint: disable=C0301
+        "singularity_subprocess_spawns_total": ( "counter", "Commands run by configurators.", ), # pylint: disable=C0301
+        "singularity_unchanged_total": ( "counter", "Configurators skipped because their input was already applied.", ), # pylint: disable=C0301
+        "singularity_jobs_total": ( "counter", "Background jobs finished by state.", ), # pylint: disable=C0301
+        "singularity_timeouts_total": ( "counter", "Configurators stopped by their deadline by function.", ), # pylint: disable=C0301
+        "singularity_communicator_queue_depth": ( "gauge", "Messages waiting in the communicator.", ), # pylint: disable=C0301
+        "singularity_communicator_queue_high_water": ( "gauge", "Most messages that have waited in the communicator at once.", ), # pylint: disable=C0301
+        "singularity_communicator_enqueued_total": ( "counter", "Messages queued by the communicator.", ), # pylint: disable=C0301
+        "singularity_communicator_dropped_total": ( "counter", "Messages answered busy because the communicator's queue was full by overflow policy.", ), # pylint: disable=C0301
+        "singularity_pipeline_pending": ( "gauge", "Requests waiting for a worker.", ), # pylint: disable=C0301
+        "singularity_executable_cache_hits_total": ( "counter", "helpers.which lookups answered from the cache.", ), # pylint: disable=C0301
+        "singularity_executable_cache_misses_total": ( "counter", "helpers.which lookups that searched the PATH.", ), # pylint: disable=C0301
+        "singularity_resident_memory_bytes": ( "gauge", "Resident set size of the daemon.", ), # pylint: disable=C0301
+        }
+
+_LOCK = threading.Lock()
+_COUNTERS = {}
+_HISTOGRAMS = {}
+_GAUGES = {}
+
+def increment(name, value = 1, **labels):
+    """Add value to the counter name with the given labels."""
+
+    key = (name, tuple(sorted(labels.iteritems())))
+
+    with _LOCK:
+        _COUNTERS[key] = _COUNTERS.get(key, 0) + value
+
+def observe(name, value, **labels):
+    """Record value in the histogram name with the given labels."""
+
+    key = (name, tuple(sorted(labels.iteritems())))
+
+    with _LOCK:
+        if key not in _HISTOGRAMS:
+            _HISTOGRAMS[key] = [ [ 0 ] * len(BUCKETS), 0, 0.0 ]
+
+        histogram = _HISTOGRAMS[key]
+
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                histogram[0][index] += 1
+
+        histogram[1] += 1
+        histogram[2] += value
+
+def gauge(name, callback, **labels):
+    """Register callback as the source of the gauge name.
+
+    ### Description
+
+    The callback is called without arguments every time the metrics are
+    rendered and must return a number.  Registering a gauge again with the
+    same labels replaces the callback.
+
+    """
+
+    key = (name, tuple(sorted(labels.iteritems())))
+
+    with _LOCK:
+        _GAUGES[key] = callback
+
+def counters(name):
+    """The values of the counter name as a dict keyed by label tuples."""
+
+    with _LOCK:
+        return dict([ (labels, value) for (name_, labels), value in _COUNTERS.iteritems() if name_ == name ]) # pylint: disable=C0301
+
+def histograms(name):
+    """The histogram name as a dict of label tuples to (buckets, count, sum)."""
+
+    with _LOCK:
+        return dict([ (labels, ( list(value[0]), value[1], value[2], )) for (name_, labels), value in _HISTOGRAMS.iteritems() if name_ == name ]) # pylint: disable=C0301
+
+def quantile(buckets, count, fraction):
+    """Upper bound of the bucket holding the fraction quantile (or None)."""
+
+    if not count:
+        return None
+
+    for bound, value in zip(BUCKETS, buckets):
+        if value >= fraction * count:
+            return bound
+
+    return "+Inf"
+
+def render():
+    """The current metrics in the Prometheus text exposition format."""
+
+    samples = {}
+
+    with _LOCK:
+        counters = dict(_COUNTERS)
+        histograms = dict([ (key, [ list(value[0]), value[1], value[2] ]) for key, value in _HISTOGRAMS.iteritems() ]) # pylint: disable=C0301
+        gauges = dict(_GAUGES)
+
+    for (name, labels), value in counters.iteritems():
+        samples.setdefault(name, []).append((name, labels, value))
+
+    for (name, labels), (buckets, count, total) in histograms.iteritems():
+        for bound, value in zip(BUCKETS, buckets):
+            samples.setdefault(name, []).append((name + "_bucket", labels + (("le", repr(bound)),), value)) # pylint: disable=C0301
+        samples.setdefault(name, []).append((name + "_bucket", labels + (("le", "+Inf"),), count)) # pylint: disable=C0301
+        samples.setdefault(name, []).append((name + "_count", labels, count))
+        samples.setdefault(name, []).append((name + "_sum", labels, total))
+
+    for (name, labels), callback in gauges.iteritems():
+        try:
+            value = callback()
+        except Exception as error: # pylint: disable=W0703
+            logger.warning("Gauge, %s, failed: %s", name, error)
+            continue
+
+        samples.setdefault(name, []).append((name, labels, value))
+
+    lines = []
+
+    for name in sorted(samples):
+        type_, help_ = DESCRIPTIONS.get(name, ( "untyped", name, ))
+
+        lines.append("# HELP {0} {1}".format(name, help_))
+        lines.append("# TYPE {0} {1}".format(name, type_))
+
+        for sample, labels, value in samples[name]:
+            if len(labels):
+                sample += "{" + ",".join([ "{0}=\"{1}\"".format(label, _escape(value_)) for label, value_ in labels ]) + "}" # pylint: disable=C0301
+
+            lines.append("{0} {1}".format(sample, value))
+
+    return "\n".join(lines) + "\n"
+
+def resident_memory():
+    """Resident set size of this process in bytes."""
+
+    with open(os.path.join(os.path.sep, "proc", "self", "statm"), "r") as statm: # pylint: disable=C0301
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+class MetricsHandler(SocketServer.StreamRequestHandler):
+    """Writes the rendered metrics to each connection.
+
+    ### Description
+
+    If the client sends an HTTP request line a minimal HTTP/1.0 response is
+    returned; clients that don't send anything within a moment get the bare
+    text.
+
+    """
+
+    timeout = 0.5
+
+    def handle(self):
+        request = ""
+
+        try:
+            request = self.rfile.readline()
+        except socket.timeout:
+            pass
+
+        body = render()
+
+        if request.startswith("GET"):
+            self.wfile.write("HTTP/1.0 200 OK\r\n")
+            self.wfile.write("Content-Type: text/plain; version=0.0.4\r\n")
+            self.wfile.write("Content-Length: {0}\r\n\r\n".format(len(body)))
+
+        self.wfile.write(body)
+
+class MetricsServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer): # pylint: disable=R0904
+    daemon_threads = True
+
+def serve(path):
+    """Serve the metrics on the unix socket at path from a daemon thread."""
+
+    if os.access(path, os.W_OK):
+        os.remove(path)
+
+    logger.info("Serving metrics on %s", path)
+
+    server = MetricsServer(path, MetricsHandler)
+
+    thread = threading.Thread(target = server.serve_forever, name = "singularity-metrics") # pylint: disable=C0301
+    thread.daemon = True
+    thread.start()
+
+    return server
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") # pylint: disable=C0301
@@ -58,7 +58,7 @@ COMMON_PARAMETERS = [
             },
         { # --functions=FUNCTIONS, -F=FUNCTIONS; FUNCTIONS => network,hosts,resolvers,reboot,password # pylint: disable=C0301
             "options": [ "--functions", "-F" ],
-            "default": "network,hosts,hostname,resolvers,password,file,update,version,features", # TODO Generate this somehow? # pylint: disable=C0301
+            "default": "network,hosts,hostname,resolvers,password,file,update,version,features,job", # TODO Generate this somehow? # pylint: disable=C0301
             "metavar": "FUNCTIONS",
             "help": \
                     "The functions that should be handled by singularity.  " \
@@ -146,6 +146,189 @@ DAEMON_PARAMETERS = [
                     "or by the administrator.  Defaults to []; which " \
                     "includes no extra directories.",
             },
+        { # --workers=COUNT, -w=COUNT; COUNT => 4
+            "options": [ "--workers", "-w" ],
+            "type": int,
+            "default": 4,
+            "metavar": "COUNT",
+            "help": \
+                    "The number of messages from the hypervisor that are " \
+                    "handled at the same time.  Messages for the same " \
+                    "function are still handled in order (see the " \
+                    "[concurrency] section of singularity.conf).  COUNT " \
+                    "defaults to 4.",
+            },
+        { # --jobs=COUNT; COUNT => 1
+            "options": [ "--jobs" ],
+            "type": int,
+            "default": 1,
+            "metavar": "COUNT",
+            "help": \
+                    "The number of long running messages (i.e. update) " \
+                    "handled in the background at the same time.  They are " \
+                    "answered with a job identifier straight away and can " \
+                    "be polled with a job message.  COUNT defaults to 1.",
+            },
+        { # --timeout=SECONDS; SECONDS => 600
+            "options": [ "--timeout" ],
+            "type": int,
+            "default": 600,
+            "metavar": "SECONDS",
+            "help": \
+                    "The time commands run for a message (i.e. ip or " \
+                    "emerge) may take before they are killed and a failure " \
+                    "is returned.  Can be set per function in the [timeout] " \
+                    "section of singularity.conf.  0 disables the limit.  " \
+                    "SECONDS defaults to 600.",
+            },
+        { # --aging=SECONDS; SECONDS => 10
+            "options": [ "--aging" ],
+            "type": int,
+            "default": 10,
+            "metavar": "SECONDS",
+            "help": \
+                    "Waiting messages are promoted one priority class (see " \
+                    "the [priority] section of singularity.conf) for every " \
+                    "SECONDS they wait so low priority work is not starved.  " \
+                    "SECONDS defaults to 10.",
+            },
+        { # --tracing
+            "options": [ "--tracing" ],
+            "action": "store_true",
+            "default": False,
+            "help": \
+                    "Record the time spent in each stage of handling every " \
+                    "message and write it to trace.json in the run " \
+                    "directory (Chrome trace event format).  Defaults to " \
+                    "False.",
+            },
+        { # --tracesize=BYTES; BYTES => 1048576
+            "options": [ "--tracesize" ],
+            "type": int,
+            "default": 1048576,
+            "metavar": "BYTES",
+            "help": \
+                    "The size trace.json may reach before it is rotated " \
+                    "(three old files are kept).  BYTES defaults to 1048576.",
+            },
+        { # --profiler=MODE; MODE => sampling
+            "options": [ "--profiler" ],
+            "choices": [ "sampling", "cprofile", "both", ],
+            "default": "sampling",
+            "metavar": "MODE",
+            "help": \
+                    "What SIGUSR1 (or the profile control command) " \
+                    "collects until it is sent again: sampling writes the " \
+                    "threads' stacks sampled every few milliseconds to " \
+                    "profile-TIME.collapsed in the run directory, cprofile " \
+                    "writes a cProfile of every request and job to " \
+                    "profile-TIME.pstats and both does both.  MODE " \
+                    "defaults to sampling.",
+            },
+        { # --nometrics
+            "options": [ "--nometrics" ],
+            "action": "store_true",
+            "default": False,
+            "help": \
+                    "Don't serve metrics (Prometheus text format) on " \
+                    "metrics.sock in the run directory.  Defaults to False.",
+            },
+        { # --nojournal
+            "options": [ "--nojournal" ],
+            "action": "store_true",
+            "default": False,
+            "help": \
+                    "Don't keep a journal of the messages received but not " \
+                    "yet answered (journal in the run directory) to handle " \
+                    "again after a restart.  Only used with communicators " \
+                    "whose requests survive a restart (Xen).  Defaults to " \
+                    "False.",
+            },
+        { # --noexecutor
+            "options": [ "--noexecutor" ],
+            "action": "store_true",
+            "default": False,
+            "help": \
+                    "Run the commands configurators need (i.e. ip) by " \
+                    "forking the daemon rather than handing them to a " \
+                    "small helper process started with the daemon.  " \
+                    "Defaults to False.",
+            },
+        { # --handoff
+            "options": [ "--handoff" ],
+            "action": "store_true",
+            "default": False,
+            "help": \
+                    "Restart by starting a new daemon that takes the " \
+                    "communicator (and the messages it has queued) over " \
+                    "from the running one rather than stopping the running " \
+                    "daemon first.  The running daemon exits once it has " \
+                    "answered what it already received.  Defaults to False.",
+            },
+        { # --queuesize=SIZE; SIZE => 256
+            "options": [ "--queuesize" ],
+            "type": int,
+            "default": 256,
+            "metavar": "SIZE",
+            "help": \
+                    "The number of requests that may wait to be received " \
+                    "from the hypervisor or socket clients (0 for no " \
+                    "limit).  SIZE defaults to 256.",
+            },
+        { # --overflow=POLICY; POLICY => dropoldest
+            "options": [ "--overflow" ],
+            "choices": [ "dropoldest", "busy", ],
+            "default": "dropoldest",
+            "metavar": "POLICY",
+            "help": \
+                    "What happens to a request once --queuesize requests " \
+                    "are waiting: dropoldest answers the oldest waiting " \
+                    "request for a function in --idempotent (which a later " \
+                    "one supersedes) with busy (returncode 75) to make " \
+                    "room, busy answers the new request with busy.  " \
+                    "dropoldest acts as busy if no such request is " \
+                    "waiting.  POLICY defaults to dropoldest.",
+            },
+        { # --networkwait=SECONDS; SECONDS => 30
+            "options": [ "--networkwait" ],
+            "type": float,
+            "default": 30,
+            "metavar": "SECONDS",
+            "help": \
+                    "How long resetnetwork waits for the hypervisor to " \
+                    "write the networking entries of every interface " \
+                    "before going ahead with the entries there are.  Only " \
+                    "used by the Xen communicator.  SECONDS defaults to 30.",
+            },
+        { # --idempotent=FUNCTIONS; FUNCTIONS => resetnetwork
+            "options": [ "--idempotent" ],
+            "default": "resetnetwork",
+            "metavar": "FUNCTIONS",
+            "help": \
+                    "Messages for these functions are only applied if they " \
+                    "differ from the last one applied (per configurator).  " \
+                    "Unchanged messages are answered with success straight " \
+                    "away.  FUNCTIONS defaults to resetnetwork.",
+            },
+        { # --force
+            "options": [ "--force" ],
+            "action": "store_true",
+            "default": False,
+            "help": \
+                    "Apply every message even if it is identical to the " \
+                    "last one applied (see --idempotent).  A message can " \
+                    "ask for the same with \"force\": true.  Defaults to " \
+                    "False.",
+            },
+        { # --record=FILE
+            "options": [ "--record" ],
+            "metavar": "FILE",
+            "help": \
+                    "Append every message received (as received from the " \
+                    "hypervisor) to FILE so it can be replayed with " \
+                    "scripts/replay.  Password values are not recorded.  " \
+                    "Nothing is recorded by default.",
+            },
         ]
 
 DEFAULTS = {}
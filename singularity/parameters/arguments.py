@@ -85,7 +85,7 @@ class SingularityArguments(object):
             logger.debug("Adding option, %s, with options, %s and %s", name, options["args"], options["kwargs"]) # pylint: disable=C0301
             self._daemon_parser.add_argument(*options["args"], **options["kwargs"]) # pylint: disable=W0142,C0301
 
-        actions = [ "start", "stop", "restart", "reload", "status" ]
+        actions = [ "start", "stop", "restart", "reload", "status", "drain" ]
         self._daemon_parser.add_argument("action", metavar = "ACTION",
                 choices = actions, help = \
                         "Specifies what action to take when controlling the " \
@@ -0,0 +1,685 @@
+# Copyright (C) 2012 by Alex Brandt <alunduil@alunduil.com>
+#
+# singularity is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+import logging
+import threading
+import functools
+import hashlib
+import json
+import time
+
+from singularity import helpers
+from singularity import metrics
+from singularity import profiler
+from singularity import tracing
+from singularity.parameters import SingularityParameters
+from singularity.applicator import SingularityApplicator
+from singularity.cache import SingularityCache, fingerprint_name
+from singularity.jobs import SingularityJobs
+
+logger = logging.getLogger("console") # pylint: disable=C0103
+
+class SingularityRequest(object): # pylint: disable=R0903
+    """A message received from the hypervisor and the work it implies.
+
+    ### Description
+
+    Holds the identifier and message as returned by Communicator.receive along
+    with the configurators that will handle the message.  The functions of
+    those configurators are the resources the request holds while it runs.
+
+    Identical messages received while a request is still pending are folded
+    into it; identifiers holds every identifier that gets the response.
+
+    """
+
+    def __init__(self, identifier, message, configurators, key = None, trace = tracing.NULL_TRACE): # pylint: disable=C0301,R0913
+        self.identifiers = [ identifier ]
+        self.message = message
+        self.configurators = configurators
+        self.functions = set([ configurator.function for configurator in configurators ]) # pylint: disable=C0301
+        self.key = key
+        self.trace = trace
+        self.queued = time.time()
+        self.started = None
+        self.priority = PRIORITIES["normal"]
+        self.holders = 1 # The worker, plus the job if it becomes one.
+
+    def __repr__(self):
+        return "<SingularityRequest {0} {1}>".format(self.identifiers, sorted(self.functions)) # pylint: disable=C0301
+
+    @property
+    def status(self):
+        """The request as a dictionary (without the message's values)."""
+
+        return {
+                "identifiers": list(self.identifiers),
+                "function": self.message.get("function"),
+                "functions": sorted(self.functions),
+                "priority": self.priority,
+                "queued": self.queued,
+                "started": self.started,
+                "trace": self.trace.identifier,
+                }
+
+class SingularityPipeline(object):
+    """Worker pool that handles messages from the hypervisor concurrently.
+
+    ### Description
+
+    The daemon hands each received message to SingularityPipeline.submit and
+    goes back to waiting on the communicator.  A pool of worker threads
+    (daemon.workers) picks requests up and runs the configurators, cache
+    writes, SingularityApplicator and the response for each one.
+
+    Workers take the pending request with the best priority first (see
+    priority) so short control requests (i.e. version or password) overtake
+    bulk work (i.e. update or file).  Every daemon.aging seconds a request
+    waits it is promoted by one class so bulk work is never starved.
+
+    Requests that share a function are serialized: at most the number of
+    requests given for that function in the [concurrency] section of
+    singularity.conf (default 1) run at once, and a request never overtakes an
+    earlier one for the same function.  Writes of the same managed file (i.e.
+    /etc/hosts from both hosts and file) are additionally serialized by
+    filename.
+
+    Commands a configurator runs (helpers.check_call) are bounded by the
+    function's entry in the [timeout] section of singularity.conf (default
+    daemon.timeout seconds).  When it passes the command's process group is
+    killed and the hypervisor gets a response with returncode TIMEOUT_STATUS.
+
+    Hypervisors tend to repeat requests (i.e. resetnetwork or features) during
+    boot and migration.  A message identical to one that is still pending is
+    not handled again; its identifier is added to the pending request and
+    gets the same response.
+
+    Configurators whose part of a resetnetwork (or any function listed in
+    daemon.idempotent) is unchanged since it was last applied are skipped
+    (see _unapplied).
+
+    If a SingularityJournal is passed (or set as journal later) each
+    identifier is marked done in it once its response has been sent.
+
+    A pipeline created held queues requests but runs none of them until
+    release is called (i.e. until the daemon being taken over has exited).
+
+    ### Examples
+
+    Allowing two injectfile requests to run at the same time and moving
+    resetnetwork ahead of everything else:
+
+    [concurrency]
+    file = 2
+
+    [priority]
+    resetnetwork = high
+
+    """
+
+    def __init__(self, communicator, configurators, workers = None, applicator = None, journal = None, held = False): # pylint: disable=C0301,R0913
+        self._communicator = communicator
+        self._configurators = configurators
+        self._applicator = applicator or SingularityApplicator()
+        self._journal = journal
+
+        self._condition = threading.Condition()
+        self._pending = []
+        self._running = {}
+        self._active = []
+        self._limits = {}
+        self._priorities = {}
+        self._aging = None
+        self._timeouts = {}
+        self._idempotent = set()
+        self._held = held
+
+        self._send_lock = threading.Lock()
+        self._files_lock = threading.Lock()
+        self._files = {}
+
+        self.reinit(configurators)
+
+        workers = int(workers or SingularityParameters()["daemon.workers"] or 1) # pylint: disable=C0301
+
+        logger.info("Starting %s workers", workers)
+
+        self._workers = []
+        for number in range(workers):
+            worker = threading.Thread(target = self._work, name = "singularity-worker-{0}".format(number)) # pylint: disable=C0301
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def release(self):
+        """Let the workers run the requests of a held pipeline."""
+
+        with self._condition:
+            self._held = False
+            self._condition.notify_all()
+
+    @property
+    def pending(self):
+        """Number of requests waiting for a worker."""
+        return len(self._pending)
+
+    @property
+    def idle(self):
+        """True if no request is waiting for or held by a worker."""
+        with self._condition:
+            return not len(self._pending) and not len(self._active)
+
+    @property
+    def requests(self):
+        """Status of the pending and running requests (as dictionaries)."""
+
+        with self._condition:
+            return {
+                    "pending": [ request.status for request in self._pending ],
+                    "running": [ request.status for request in self._active ],
+                    }
+
+    def timings(self):
+        """Time spent in the configurators of each function by stage.
+
+        ### Description
+
+        Summarizes the singularity_configurator_seconds histograms as count,
+        total and mean seconds and the upper bounds of the buckets holding
+        the median and 99th percentile.
+
+        """
+
+        functions = dict([ (configurator.__class__.__name__, configurator.function) for configurator in self._configurators ]) # pylint: disable=C0301
+
+        totals = {}
+
+        for labels, (buckets, count, total) in metrics.histograms("singularity_configurator_seconds").iteritems(): # pylint: disable=C0301
+            labels = dict(labels)
+
+            key = (functions.get(labels["configurator"], labels["configurator"]), labels["stage"]) # pylint: disable=C0301
+
+            if key not in totals:
+                totals[key] = [ [ 0 ] * len(buckets), 0, 0.0 ]
+
+            totals[key][0] = [ a + b for a, b in zip(totals[key][0], buckets) ]
+            totals[key][1] += count
+            totals[key][2] += total
+
+        timings = {}
+
+        for (function, stage), (buckets, count, total) in totals.iteritems():
+            timings.setdefault(function, {})[stage] = {
+                    "count": count,
+                    "seconds": total,
+                    "mean": total / count if count else None,
+                    "p50": metrics.quantile(buckets, count, 0.5),
+                    "p99": metrics.quantile(buckets, count, 0.99),
+                    }
+
+        return timings
+
+    @property
+    def journal(self):
+        """The SingularityJournal responses are marked done in (or None)."""
+        return self._journal
+
+    @journal.setter
+    def journal(self, journal): # pylint: disable=C0111
+        with self._send_lock:
+            self._journal = journal
+
+    def reinit(self, configurators):
+        """Swap in a new set of configurators and re-read the limits."""
+
+        with self._condition:
+            self._configurators = configurators
+            self._limits = {}
+
+            self._timeouts = {}
+
+            for function in set([ configurator.function for configurator in configurators ]): # pylint: disable=C0301
+                self._limits[function] = limit(function)
+                self._timeouts[function] = timeout(function)
+
+            logger.debug("Concurrency limits: %s", self._limits)
+
+            self._priorities = {}
+            self._aging = max(1, int(SingularityParameters()["daemon.aging"] or 1)) # pylint: disable=C0301
+
+            self._idempotent = set([ function.strip() for function in (SingularityParameters()["daemon.idempotent"] or "").split(",") if len(function.strip()) ]) # pylint: disable=C0301
+
+            self._condition.notify_all()
+
+    def submit(self, identifier, message, trace = tracing.NULL_TRACE):
+        """Queue a received message for the workers.
+
+        ### Arguments
+
+        Argument   | Description
+        --------   | -----------
+        identifier | The identifier returned by Communicator.receive.
+        message    | The message returned by Communicator.receive.
+        trace      | The SingularityTrace started for the message.
+
+        ### Description
+
+        Finds the configurators that will handle the message and queues the
+        request.  If an identical message is already pending the identifier is
+        added to that request instead.  Returns the queued SingularityRequest.
+
+        """
+
+        metrics.increment("singularity_requests_total", function = message.get("function", "")) # pylint: disable=C0301
+
+        key = fingerprint(message)
+
+        with self._condition:
+            for request in self._pending:
+                if key is not None and request.key == key:
+                    request.identifiers.append(identifier)
+                    logger.info("Coalesced identifier, %s, into request, %s", identifier, request) # pylint: disable=C0301
+                    trace.add("coalesced", time.time(), time.time(), into = request.trace.identifier) # pylint: disable=C0301
+                    trace.finish()
+                    return request
+
+        with trace.span("dispatch"):
+            configurators = self.dispatch(message, trace)
+
+        request = SingularityRequest(identifier, message, configurators, key, trace) # pylint: disable=C0301
+
+        logger.info("Queueing request, %s", request)
+
+        with self._condition:
+            function = message.get("function", "")
+            if function not in self._priorities:
+                self._priorities[function] = priority(function)
+            request.priority = self._priorities[function]
+
+            self._pending.append(request)
+            self._condition.notify()
+
+        return request
+
+    def dispatch(self, message, trace = tracing.NULL_TRACE):
+        """The allowed and runnable configurators for the message."""
+
+        configurators = []
+
+        for configurator in self._configurators.dispatch(message):
+            start = time.time()
+            runnable = configurator.runnable(message)
+            end = time.time()
+
+            trace.add("runnable", start, end, configurator = configurator.__class__.__name__) # pylint: disable=C0301
+            metrics.observe("singularity_configurator_seconds", end - start, configurator = configurator.__class__.__name__, stage = "runnable") # pylint: disable=C0301
+
+            if not runnable:
+                logger.info("Configurator, %s, is not runnable.", configurator) # pylint: disable=C0301
+                continue
+
+            logger.info("Found configurator, %s, with function, %s", configurator, configurator.function) # pylint: disable=C0301
+            configurators.append(configurator)
+
+        return configurators
+
+    def _next(self):
+        """Remove and return the request that should run next.
+
+        ### Description
+
+        Must be called with self._condition held.  Pending requests are
+        considered by their priority less one for every daemon.aging seconds
+        they have waited, ties going to the earliest.  Returns None if every
+        pending request is waiting on a function that is at its limit or on an
+        earlier request for one of its functions (or the pipeline is held).
+
+        """
+
+        if self._held:
+            return None
+
+        now = time.time()
+
+        before = []
+        functions = set()
+        for request in self._pending:
+            before.append(functions)
+            functions = functions | request.functions
+
+        order = sorted(range(len(self._pending)), key = lambda index: (self._pending[index].priority - int((now - self._pending[index].queued) / self._aging), index)) # pylint: disable=C0301
+
+        for index in order:
+            request = self._pending[index]
+
+            if request.functions & before[index]:
+                continue
+
+            if all([ self._running.get(function, 0) < self._limits.get(function, 1) for function in request.functions ]): # pylint: disable=C0301
+                del self._pending[index]
+                return request
+
+        return None
+
+    def _work(self):
+        """Worker thread main loop."""
+
+        while True:
+            with self._condition:
+                request = self._next()
+                while request is None:
+                    self._condition.wait()
+                    request = self._next()
+
+                self._active.append(request)
+
+                for function in request.functions:
+                    self._running[function] = self._running.get(function, 0) + 1 # pylint: disable=C0301
+
+            request.started = time.time()
+            request.trace.add("queue", request.queued, request.started)
+            tracing.activate(request.trace)
+
+            try:
+                profiler.profiled(self.handle, request)
+            except Exception as error: # pylint: disable=W0703
+                logger.exception(error) # Keep the worker for the next request.
+            finally:
+                tracing.activate(tracing.NULL_TRACE)
+
+                self._release(request)
+
+    def _release(self, request):
+        """Let go of request (by the worker or its job).
+
+        ### Description
+
+        A request that became a job keeps its functions (and so the
+        [concurrency] limits) and its trace until both the worker has sent the
+        job's identifier and the job has finished; the last of the two to let
+        go finishes the trace and frees the functions.
+
+        """
+
+        with self._condition:
+            request.holders -= 1
+
+            if request.holders:
+                return
+
+            self._active.remove(request)
+
+            for function in request.functions:
+                self._running[function] -= 1
+            self._condition.notify_all()
+
+        request.trace.finish()
+
+    def handle(self, request):
+        """Run the configurators for a request and send the response.
+
+        ### Description
+
+        If any of the request's configurators is long running the request is
+        submitted to SingularityJobs instead and the response is the job's
+        identifier.  The job records its spans on the request's trace and holds
+        the request's functions until it finishes (see _release).
+
+        A failure to submit the job is answered as an error.  A response that
+        cannot be sent is logged and left in the journal (the other identifiers
+        of a coalesced request are still answered).
+
+        """
+
+        logger.info("Handling request, %s", request)
+
+        try:
+            if any([ configurator.long_running for configurator in request.configurators ]): # pylint: disable=C0301
+                with self._condition:
+                    request.holders += 1
+
+                try:
+                    job = SingularityJobs().submit(functools.partial(self._run, request), request.functions, request.trace, lambda finished: self._release(request)) # pylint: disable=C0301
+                except Exception:
+                    self._release(request)
+                    raise
+
+                response, status = job.identifier, 0
+            else:
+                response, status = self._run(request)
+        except Exception as error: # pylint: disable=W0703
+            logger.exception(error)
+            response, status = str(error), 1
+
+        with request.trace.span("send"), self._send_lock:
+            for identifier in request.identifiers:
+                try:
+                    self._communicator.send(identifier, response, status)
+
+                    if self._journal is not None:
+                        self._journal.done(identifier)
+                except Exception as error: # pylint: disable=W0703
+                    logger.error("Response to, %s, not sent", identifier)
+                    logger.exception(error)
+
+    def _run(self, request):
+        """Run the configurators for a request and apply what they produced.
+
+        ### Description
+
+        Returns the response and status to send to the hypervisor.
+
+        """
+
+        response = ""
+        status = 0
+
+        try:
+            files = {}
+
+            configurators, digests = self._unapplied(request)
+
+            for configurator in configurators:
+                start = time.time()
+                try:
+                    with helpers.deadline(self._timeouts.get(configurator.function)): # pylint: disable=C0301
+                        contents = configurator.content(request.message)
+                except helpers.DeadlineExceeded:
+                    metrics.increment("singularity_timeouts_total", function = configurator.function) # pylint: disable=C0301
+                    raise
+                finally:
+                    end = time.time()
+                    request.trace.add("content", start, end, configurator = configurator.__class__.__name__) # pylint: disable=C0301
+                    metrics.observe("singularity_configurator_seconds", end - start, configurator = configurator.__class__.__name__, stage = "content") # pylint: disable=C0301
+
+                for filename, content in contents.iteritems():
+                    if "message" == filename:
+                        response += content + "\n"
+                    elif filename.startswith("/"):
+                        files[configurator.function + "." + filename] = content # pylint: disable=C0301
+
+            locks = self._locks([ key.split('.', 1)[1] for key in files.iterkeys() ]) # pylint: disable=C0301
+
+            for lock in locks:
+                lock.acquire()
+
+            try:
+                with request.trace.span("cache"):
+                    for key, content in files.iteritems():
+                        SingularityCache()[key] = content
+
+                logger.info("Applying the functions found ...")
+                logger.debug("Functions found: %s", request.functions)
+
+                with request.trace.span("apply"):
+                    self._applicator(actions = request.functions, keys = files.keys()) # pylint: disable=C0301
+            finally:
+                for lock in reversed(locks):
+                    lock.release()
+
+            for name, digest in digests.iteritems():
+                SingularityCache().set_fingerprint(name, digest)
+        except helpers.DeadlineExceeded as error:
+            logger.error("Request, %s, timed out: %s", request, error)
+            response = str(error)
+            status = TIMEOUT_STATUS
+        except Exception as error: # pylint: disable=W0703
+            logger.exception(error)
+            response = str(error)
+            status = 1
+
+        response = "" + "\n" + response
+
+        return response.strip(), status
+
+    def _unapplied(self, request):
+        """The configurators of request that still need to run.
+
+        ### Description
+
+        For messages whose function is listed in daemon.idempotent (i.e.
+        resetnetwork) each configurator's part of the message (its
+        message_keys) is fingerprinted and compared to the fingerprint last
+        applied by that configurator.  Configurators with nothing new are
+        skipped; if that leaves none the request is answered straight away with
+        success.
+
+        Nothing is skipped if the message has force set or daemon.force is on.
+
+        Returns the configurators to run and the fingerprints to record for
+        them (by singularity.cache.fingerprint_name) once they have been
+        applied.
+
+        """
+
+        if request.message.get("function") not in self._idempotent or request.message.get("force") or SingularityParameters()["daemon.force"]: # pylint: disable=C0301
+            return request.configurators, {}
+
+        configurators = []
+        digests = {}
+
+        for configurator in request.configurators:
+            keys = configurator.message_keys or [ key for key in request.message.iterkeys() if key != "force" ] # pylint: disable=C0301
+            digest = fingerprint(dict([ (key, request.message.get(key)) for key in keys ])) # pylint: disable=C0301
+
+            name = fingerprint_name(configurator)
+
+            if digest is not None and digest == SingularityCache().get_fingerprint(name): # pylint: disable=C0301
+                logger.info("Skipping %s; nothing changed since it was last applied", configurator) # pylint: disable=C0301
+                metrics.increment("singularity_unchanged_total", function = configurator.function) # pylint: disable=C0301
+                continue
+
+            configurators.append(configurator)
+
+            if digest is not None:
+                digests[name] = digest
+
+        return configurators, digests
+
+    def _locks(self, filenames):
+        """The per file locks for the filenames in a consistent order."""
+
+        locks = []
+
+        with self._files_lock:
+            for filename in sorted(set(filenames)):
+                if filename not in self._files:
+                    self._files[filename] = threading.Lock()
+                locks.append(self._files[filename])
+
+        return locks
+
+TIMEOUT_STATUS = 124 # Same as timeout(1).
+
+PRIORITIES = {
+        "high": 0,
+        "normal": 1,
+        "low": 2,
+        }
+
+DEFAULT_PRIORITIES = {
+        "keyinit": "high",
+        "password": "high",
+        "version": "high",
+        "features": "high",
+        "job": "high",
+        "file": "low",
+        "update": "low",
+        }
+
+def priority(function):
+    """The priority class of requests for function (lower runs first).
+
+    ### Description
+
+    Reads the function's entry in the [priority] section of singularity.conf
+    which may be one of the PRIORITIES names (high, normal or low) or a number.
+    keyinit, password, version, features and job default to high; file and
+    update to low; everything else to normal.
+
+    """
+
+    value = SingularityParameters()["priority." + function] or DEFAULT_PRIORITIES.get(function, "normal") # pylint: disable=C0301
+
+    if value in PRIORITIES:
+        return PRIORITIES[value]
+
+    try:
+        return int(value)
+    except ValueError:
+        logger.warning("Invalid priority, %s, for function, %s", value, function) # pylint: disable=C0301
+        return PRIORITIES["normal"]
+
+def limit(function):
+    """The number of requests for function that may run at once.
+
+    ### Description
+
+    Reads the function's entry in the [concurrency] section of
+    singularity.conf and defaults to 1 (requests for a function are handled
+    one at a time).
+
+    """
+
+    value = SingularityParameters()["concurrency." + function]
+
+    try:
+        return max(1, int(value or 1))
+    except ValueError:
+        logger.warning("Invalid concurrency, %s, for function, %s", value, function) # pylint: disable=C0301
+        return 1
+
+def fingerprint(message):
+    """A digest identifying the content of a message.
+
+    ### Description
+
+    Messages that compare equal have the same fingerprint.  Returns None if
+    the message can't be serialized (and so can't be compared this way).
+
+    """
+
+    try:
+        return hashlib.sha1(json.dumps(message, sort_keys = True)).hexdigest()
+    except (TypeError, ValueError):
+        return None
+
+def timeout(function):
+    """Seconds the commands run for a function's configurator may take.
+
+    ### Description
+
+    Reads the function's entry in the [timeout] section of singularity.conf and
+    defaults to daemon.timeout.  0 disables the deadline.
+
+    """
+
+    value = SingularityParameters()["timeout." + function] or SingularityParameters()["daemon.timeout"] # pylint: disable=C0301
+
+    try:
+        return max(0, int(value or 0))
+    except ValueError:
+        logger.warning("Invalid timeout, %s, for function, %s", value, function) # pylint: disable=C0301
+        return int(SingularityParameters()["daemon.timeout"] or 0)
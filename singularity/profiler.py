@@ -0,0 +1,185 @@
+# Copyright (C) 2012 by Alex Brandt <alunduil@alunduil.com>
+#
+# singularity is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""On demand profiling of the running daemon.
+
+### Description
+
+SIGUSR1 (or the profile control command) toggles profiling; the second toggle
+writes what was collected to daemon.run and returns the files written.  What
+is collected depends on daemon.profiler:
+
+sampling (the default) samples the stacks of every thread (sys._current_frames)
+every INTERVAL seconds and writes profile-TIME.collapsed: one line per
+distinct stack, outermost frame first, with the number of samples (the
+collapsed format flamegraph.pl and speedscope read).  The overhead is a
+fraction of a millisecond per sample regardless of what the daemon does.
+
+cprofile runs cProfile around every request a worker handles and every job
+(see profiled) and writes the merged profile-TIME.pstats:
+
+>>> python -m pstats /var/run/singularity/profile-20130101-120000.pstats
+
+both does both.
+
+"""
+
+import logging
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+
+from singularity.parameters import SingularityParameters
+
+logger = logging.getLogger("console") # pylint: disable=C0103
+
+INTERVAL = 0.005
+
+_LOCK = threading.Lock()
+_SESSION = None
+
+class ProfilingSession(object):
+    """What is being collected between two toggles."""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.started = time.time()
+
+        self.profiles = []
+        self.stacks = {}
+        self.samples = 0
+
+        self._stop = threading.Event()
+        self._sampler = None
+
+        if self.mode in [ "sampling", "both", ]:
+            self._sampler = threading.Thread(target = self._sample, name = "singularity-profiler") # pylint: disable=C0301
+            self._sampler.daemon = True
+            self._sampler.start()
+
+    @property
+    def cprofile(self):
+        """True if requests and jobs should run under cProfile."""
+        return self.mode in [ "cprofile", "both", ]
+
+    def stop(self):
+        """Stop sampling (waiting for the sampler to finish)."""
+
+        self._stop.set()
+
+        if self._sampler is not None:
+            self._sampler.join()
+
+    def _sample(self):
+        me = threading.current_thread().ident
+
+        while not self._stop.wait(INTERVAL):
+            names = dict([ (thread.ident, thread.name) for thread in threading.enumerate() ]) # pylint: disable=C0301
+
+            for ident, frame in sys._current_frames().items(): # pylint: disable=W0212
+                if ident == me:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("{0} ({1}:{2})".format(code.co_name, code.co_filename, code.co_firstlineno)) # pylint: disable=C0301
+                    frame = frame.f_back
+
+                stack.append(names.get(ident, str(ident)))
+                stack.reverse()
+
+                key = ";".join(stack)
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+            self.samples += 1
+
+    def write(self, directory):
+        """Write what was collected to directory and return the paths."""
+
+        prefix = os.path.join(directory, time.strftime("profile-%Y%m%d-%H%M%S", time.localtime(self.started))) # pylint: disable=C0301
+
+        paths = []
+
+        if self._sampler is not None:
+            with open(prefix + ".collapsed", "w") as collapsed:
+                for stack, count in sorted(self.stacks.iteritems()):
+                    collapsed.write("{0} {1}\n".format(stack, count))
+
+            paths.append(prefix + ".collapsed")
+
+        if self.cprofile and len(self.profiles):
+            statistics = pstats.Stats(self.profiles[0])
+            for profile in self.profiles[1:]:
+                statistics.add(profile)
+
+            statistics.dump_stats(prefix + ".pstats")
+
+            paths.append(prefix + ".pstats")
+
+        return paths
+
+def toggle():
+    """Start profiling or stop it and write the results.
+
+    ### Description
+
+    Returns a dictionary with the new state (profiling or stopped) and, when
+    stopping, the files written to daemon.run.
+
+    """
+
+    global _SESSION # pylint: disable=W0603
+
+    with _LOCK:
+        session, _SESSION = _SESSION, None
+
+        if session is None:
+            _SESSION = ProfilingSession(SingularityParameters()["daemon.profiler"] or "sampling") # pylint: disable=C0301
+
+            logger.info("Started profiling (%s)", _SESSION.mode)
+
+            return { "state": "profiling", "mode": _SESSION.mode, }
+
+    session.stop()
+
+    paths = session.write(SingularityParameters()["daemon.run"])
+
+    logger.info("Stopped profiling after %.1f seconds, wrote %s", time.time() - session.started, paths) # pylint: disable=C0301
+
+    return {
+            "state": "stopped",
+            "mode": session.mode,
+            "seconds": time.time() - session.started,
+            "samples": session.samples,
+            "profiles": len(session.profiles),
+            "files": paths,
+            }
+
+def mode():
+    """The mode being profiled in (None if not profiling)."""
+
+    session = _SESSION
+
+    return session.mode if session is not None else None
+
+def profiled(function, *args, **kwargs):
+    """Call function under cProfile if a cprofile session is running."""
+
+    session = _SESSION
+
+    if session is None or not session.cprofile:
+        return function(*args, **kwargs)
+
+    profile = cProfile.Profile()
+
+    try:
+        return profile.runcall(function, *args, **kwargs)
+    finally:
+        with _LOCK:
+            session.profiles.append(profile)
@@ -0,0 +1,209 @@
+# Copyright (C) 2012 by Alex Brandt <alunduil@alunduil.com>
+#
+# singularity is freely distributable under the terms of an MIT-style license.
+# See COPYING or http://www.opensource.org/licenses/mit-license.php.
+
+"""Per message latency tracing for the daemon.
+
+### Description
+
+Each message the daemon receives carries a SingularityTrace.  The stages a
+message goes through (translating, queueing, each configurator's runnable and
+content, cache writes, applying and sending) are recorded as spans on that
+trace and written, when the message is finished, to daemon.run/trace.json in
+the Chrome trace event format (load it in chrome://tracing or Perfetto).
+
+The file is rotated once it reaches daemon.tracesize bytes; three old files
+are kept.
+
+When daemon.tracing is off every trace is NULL_TRACE whose spans do nothing so
+the instrumentation costs a couple of attribute lookups.
+
+"""
+
+import logging
+import logging.handlers
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+
+from singularity.parameters import SingularityParameters
+
+logger = logging.getLogger("console") # pylint: disable=C0103
+
+_LOCAL = threading.local()
+_IDENTIFIERS = itertools.count()
+_WRITER = None
+
+class SingularityTrace(object):
+    """The spans recorded for a single message."""
+
+    def __init__(self):
+        self.identifier = "{0}-{1}".format(os.getpid(), next(_IDENTIFIERS))
+        self.events = []
+
+    def __repr__(self):
+        return "<SingularityTrace {0}>".format(self.identifier)
+
+    def span(self, name, **kwargs):
+        """Context manager that records the time spent in its body as name."""
+
+        return _Span(self, name, kwargs)
+
+    def add(self, name, start, end, **kwargs):
+        """Record a span that started and ended at the given times."""
+
+        kwargs["trace"] = self.identifier
+
+        self.events.append({
+            "name": name,
+            "cat": "singularity",
+            "ph": "X",
+            "ts": int(start * 1000000),
+            "dur": int((end - start) * 1000000),
+            "pid": os.getpid(),
+            "tid": threading.current_thread().ident,
+            "args": kwargs,
+            })
+
+    def finish(self):
+        """Write the recorded spans to the trace file."""
+
+        writer = _WRITER
+
+        if writer is None:
+            return
+
+        events, self.events = self.events, []
+
+        for event in events:
+            writer.info("%s,", json.dumps(event))
+
+class _NullTrace(object):
+    """Trace used when tracing is disabled; records nothing."""
+
+    identifier = None
+
+    def span(self, name, **kwargs): # pylint: disable=R0201,W0613
+        return _NULL_SPAN
+
+    def add(self, name, start, end, **kwargs): # pylint: disable=R0201,W0613
+        pass
+
+    def finish(self): # pylint: disable=R0201
+        pass
+
+class _Span(object): # pylint: disable=R0903
+    def __init__(self, trace, name, kwargs):
+        self.trace = trace
+        self.name = name
+        self.kwargs = kwargs
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type = None, exc_value = None, exc_tb = None):
+        if exc_type is not None:
+            self.kwargs["error"] = exc_type.__name__
+        self.trace.add(self.name, self.start, time.time(), **self.kwargs)
+
+class _NullSpan(object): # pylint: disable=R0903
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type = None, exc_value = None, exc_tb = None):
+        pass
+
+NULL_TRACE = _NullTrace()
+_NULL_SPAN = _NullSpan()
+
+class TraceFileHandler(logging.handlers.RotatingFileHandler):
+    """RotatingFileHandler that starts every file as a JSON array.
+
+    ### Description
+
+    The Chrome trace event format allows the closing bracket of the array to
+    be left off so events can be appended as they are finished.
+
+    """
+
+    def _open(self):
+        stream = logging.handlers.RotatingFileHandler._open(self)
+
+        if not stream.tell():
+            stream.write("[\n")
+
+        return stream
+
+def configure():
+    """(Re)read daemon.tracing and open or close the trace file."""
+
+    global _WRITER # pylint: disable=W0603
+
+    if _WRITER is not None:
+        for handler in list(_WRITER.handlers):
+            _WRITER.removeHandler(handler)
+            handler.close()
+        _WRITER = None
+
+    if not SingularityParameters()["daemon.tracing"]:
+        logger.info("Tracing is disabled")
+        return
+
+    path = os.path.join(SingularityParameters()["daemon.run"], "trace.json")
+
+    logger.info("Writing traces to %s", path)
+
+    handler = TraceFileHandler(path, maxBytes = int(SingularityParameters()["daemon.tracesize"]), backupCount = 3) # pylint: disable=C0301
+    handler.setFormatter(logging.Formatter("%(message)s"))
+
+    writer = logging.getLogger("singularity.tracing.events")
+    writer.propagate = False
+    writer.setLevel(logging.INFO)
+    writer.addHandler(handler)
+
+    _WRITER = writer
+
+def start():
+    """Begin a trace for a new message and make it the thread's current one."""
+
+    trace = NULL_TRACE
+
+    if _WRITER is not None:
+        trace = SingularityTrace()
+
+    activate(trace)
+
+    return trace
+
+def activate(trace):
+    """Make trace the current trace of this thread."""
+
+    _LOCAL.trace = trace
+
+def current():
+    """The current trace of this thread (NULL_TRACE if there is none)."""
+
+    return getattr(_LOCAL, "trace", NULL_TRACE)
+
+def span(name, **kwargs):
+    """Record name as a span on this thread's current trace."""
+
+    return current().span(name, **kwargs)
+
+def traced(name):
+    """Decorator that records each call of the function as a span."""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with current().span(name):
+                return function(*args, **kwargs)
+        return wrapper
+
+    return decorator